@@ -1,49 +1,148 @@
+import asyncio
+import hashlib
+import io
+import logging
 import os
+import string
 import tempfile
-import uuid
+import threading
+import time
+import zipfile
 import json
-from datetime import timedelta, datetime
-import google.generativeai as genai
+from datetime import datetime, timedelta
 
-from docxtpl import DocxTemplate
-from flask import Flask, Response, jsonify, request, abort, redirect, json, url_for, send_file
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, abort, redirect, json, url_for, \
+    send_file, stream_with_context
 from dotenv import load_dotenv
 from sqlalchemy.exc import NoResultFound
 from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+import exam
+import importer
+import llm
+import maintenance
+from artifacts import ArtifactStore
 from auth import Auth
+from cache import create_cache
 from custom_error import CustomError
 from db import DB
+from idempotency import Idempotency
+from letter_types import LETTER_TYPES
+from rate_limit import RateLimiter
+from serializers import ADMIN_LETTER_FIELDS, LETTER_FIELDS, json_response, rows_to_dicts
 
 load_dotenv()
 
-app = Flask(__name__)
-AUTH = Auth()
+api = Blueprint('api', __name__)
 dbs = DB()
-app.SECRET_KEY = os.getenv('SECRET_KEY')
-
-SESSION_DURATION = timedelta(hours=3)
+# Shared by every node when CACHE_URL names Redis, by the workers on one host for a SQLite file
+cache = create_cache()
+AUTH = Auth(dbs, cache)
+# Per-user buckets are keyed on the user rather than the session, which a new login replaces
+limiter = RateLimiter(cache=cache,
+                      user_id=lambda session_id: getattr(AUTH.get_user_from_session_id(session_id), 'id', None))
+idempotency = Idempotency(dbs)
+
+# Rendered documents are stored here per letter so repeated and ranged downloads get identical bytes
+RENDER_DIR = os.getenv('RENDER_DIR', os.path.join(tempfile.gettempdir(), 'teachers_assistant_renders'))
+artifacts = ArtifactStore(RENDER_DIR, workers=int(os.getenv('RENDER_WORKERS', '2')))
+# Start rendering as soon as a download link is issued, instead of when it is first followed
+EAGER_RENDER = os.getenv('EAGER_RENDER', '1') == '1'
 
 ADMIN_EMAIL = os.getenv('ADMIN_EMAIL')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 
-# Configure generative AI API key
-genai.configure(api_key=os.environ["API_KEY"])
 
-# In-memory storage for contexts
-context_storage = {}
+def _warm_up() -> None:
+    """ Loads the Gemini client and the DOCX renderer so the first requests do not pay for them """
+    import docxtpl  # noqa: F401
+    llm.warm_up()
+
+
+def _sweep_sessions() -> None:
+    """ Deletes expired sessions every SESSION_SWEEP_INTERVAL seconds """
+    interval = int(os.getenv('SESSION_SWEEP_INTERVAL', '300'))
+    while True:
+        time.sleep(interval)
+        try:
+            AUTH.sweep_expired_sessions()
+        except Exception:
+            logging.getLogger(__name__).exception("Session sweep failed")
+
+
+def _deliver_emails() -> None:
+    """ Sends queued emails every EMAIL_OUTBOX_INTERVAL seconds """
+    interval = int(os.getenv('EMAIL_OUTBOX_INTERVAL', '10'))
+    while True:
+        time.sleep(interval)
+        try:
+            AUTH.send_queued_emails()
+        except Exception:
+            logging.getLogger(__name__).exception("Email outbox delivery failed")
+
+
+def create_app() -> Flask:
+    """ Builds the Flask application; every worker process calls this once """
+    app = Flask(__name__)
+    app.secret_key = os.getenv('SECRET_KEY')
+    proxies = int(os.getenv('TRUSTED_PROXIES', '0'))
+    if proxies:
+        # Take the client address, scheme and host from the X-Forwarded-* headers set by that many proxies
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+    app.register_blueprint(api)
+    if os.getenv('WARM_UP_ON_START', '1') == '1':
+        threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+    if os.getenv('SESSION_SWEEP_INTERVAL', '300') != '0':
+        threading.Thread(target=_sweep_sessions, name='session-sweeper', daemon=True).start()
+    if os.getenv('EMAIL_OUTBOX_INTERVAL', '10') != '0':
+        threading.Thread(target=_deliver_emails, name='email-outbox', daemon=True).start()
+    if dbs.snapshot is not None:
+        threading.Thread(target=dbs.snapshot.run_forever, name='admin-snapshot', daemon=True).start()
+    interval = int(os.getenv('MAINTENANCE_INTERVAL', '3600'))
+    if interval:
+        threading.Thread(target=maintenance.Maintenance(dbs, RENDER_DIR).run_forever, args=(interval,),
+                         name='maintenance', daemon=True).start()
+    return app
+
+
+def _cached_response(etag: str, build_response, cache_control: str = "private, no-cache") -> Response:
+    """ Answers 304 when the client already holds `etag`, otherwise builds the full response """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = build_response()
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def _issue_download(letter_id: str, template_name: str, context: dict) -> str:
+    """ Issues a download token for a letter and returns its URL, starting the render now in eager mode """
+    file_id = dbs.add_download_token(template_name, context, letter_id=letter_id)
+    cache.set(f"download:{file_id}", json.dumps([template_name, context, letter_id]),
+              ttl=dbs.download_token_ttl.total_seconds())
+    if EAGER_RENDER:
+        artifacts.submit(letter_id, template_name, context)
+    return url_for('.download_generated_letter', file_id=file_id, template_name=template_name, _external=True)
+
 
+def _version_tag(*parts) -> str:
+    return hashlib.sha1("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()
 
-@app.errorhandler(CustomError)
+
+@api.app_errorhandler(CustomError)
 def handle_custom_error(error):
     response = jsonify({
         "message": str(error)
     })
     response.status_code = error.status_code
+    if getattr(error, "retry_after", None):
+        response.headers["Retry-After"] = str(error.retry_after)
     return response
 
 
-@app.errorhandler(HTTPException)
+@api.app_errorhandler(HTTPException)
 def handle_http_exception(error):
     response = jsonify({
         "message": error.description
@@ -52,13 +151,14 @@ def handle_http_exception(error):
     return response
 
 
-@app.route('/', methods=['GET'], strict_slashes=False)
+@api.route('/', methods=['GET'], strict_slashes=False)
 def status() -> Response:
     """ GET /home """
     return jsonify({"message": "Welcome"})
 
 
-@app.route('/register', methods=['POST'], strict_slashes=False)
+@api.route('/register', methods=['POST'], strict_slashes=False)
+@limiter.limit(ip='10/hour', total='60/minute')
 def new_user() -> tuple[Response, int]:
     """ POST /register """
     data = request.get_json()
@@ -84,7 +184,7 @@ def new_user() -> tuple[Response, int]:
         raise CustomError(str(e), 400)
 
 
-@app.route('/verify_email', methods=['POST'], strict_slashes=False)
+@api.route('/verify_email', methods=['POST'], strict_slashes=False)
 def verify_email() -> tuple[Response, int]:
     """ POST /verify_email """
     data = request.get_json()
@@ -106,7 +206,8 @@ def verify_email() -> tuple[Response, int]:
         raise CustomError(str(e), 403)
 
 
-@app.route('/login', methods=['POST'], strict_slashes=False)
+@api.route('/login', methods=['POST'], strict_slashes=False)
+@limiter.limit(ip='30/minute', user='10/minute')
 def login() -> Response:
     """ POST /login """
     data = request.get_json()
@@ -114,12 +215,11 @@ def login() -> Response:
     password = data.get("password")
 
     try:
-        valid_user = AUTH.valid_login(email, password)
+        session_id = AUTH.login(email, password)
 
-        if not valid_user:
+        if not session_id:
             abort(401, description="Invalid credentials")
 
-        session_id = AUTH.create_session(email)
         message = {"email": email, "message": "Logged in successfully"}
         response = jsonify(message)
         response.set_cookie("session_id", session_id)
@@ -129,18 +229,18 @@ def login() -> Response:
         raise CustomError(str(e), 403)
 
 
-@app.route('/logout', methods=['DELETE'], strict_slashes=False)
+@api.route('/logout', methods=['DELETE'], strict_slashes=False)
 def logout():
     """ DELETE /logout """
     user_cookie = request.cookies.get("session_id", None)
     user = AUTH.get_user_from_session_id(user_cookie)
     if user_cookie is None or user is None:
         abort(403, description="Session not found or user not authenticated")
-    AUTH.destroy_session(user.id)
+    AUTH.destroy_session(user_cookie)
     return redirect('/')
 
 
-@app.route('/profile', methods=['GET'], strict_slashes=False)
+@api.route('/profile', methods=['GET'], strict_slashes=False)
 def profile() -> Response:
     """ GET /profile """
     user_cookie = request.cookies.get("session_id", None)
@@ -149,19 +249,16 @@ def profile() -> Response:
     user = AUTH.get_user_from_session_id(user_cookie)
     if user is None:
         abort(403, description="User not authenticated")
-    if datetime.utcnow() - user.last_login > SESSION_DURATION:
-        AUTH.destroy_session(user.id)
-        abort(403, description="Session expired")
-    return jsonify({
+    return _cached_response(_version_tag('user', user.id, user.updated_at), lambda: jsonify({
         "email": user.email,
         "first_name": user.first_name,
         "last_name": user.last_name,
         "phone_number": user.phone_number,
         "gender": user.gender
-    })
+    }))
 
 
-@app.route('/profile', methods=['PUT'], strict_slashes=False)
+@api.route('/profile', methods=['PUT'], strict_slashes=False)
 def update_profile() -> tuple[Response, int]:
     """ PUT /profile """
     user_cookie = request.cookies.get("session_id", None)
@@ -190,7 +287,8 @@ def update_profile() -> tuple[Response, int]:
         raise CustomError(str(e), 400)
 
 
-@app.route('/forgot_password', methods=['POST'], strict_slashes=False)
+@api.route('/forgot_password', methods=['POST'], strict_slashes=False)
+@limiter.limit(ip='10/hour', user='3/hour', total='60/minute')
 def forgot_password() -> tuple[Response, int]:
     """ POST /forgot_password """
     data = request.get_json()
@@ -205,7 +303,7 @@ def forgot_password() -> tuple[Response, int]:
         raise CustomError(str(e), 404)
 
 
-@app.route('/reset_password', methods=['POST'], strict_slashes=False)
+@api.route('/reset_password', methods=['POST'], strict_slashes=False)
 def reset_password() -> tuple[Response, int]:
     """ POST /reset_password """
     data = request.get_json()
@@ -228,7 +326,7 @@ def reset_password() -> tuple[Response, int]:
         raise CustomError(str(e), 403)
 
 
-@app.route('/user_letters', methods=['GET'])
+@api.route('/user_letters', methods=['GET'])
 def get_user_letters():
     user_cookie = request.cookies.get("session_id", None)
     if user_cookie is None:
@@ -238,22 +336,15 @@ def get_user_letters():
     if user is None:
         return jsonify({"message": "User not authenticated"}), 403
 
-    letters = dbs.get_letters_by_user(user.id)
-    letter_list = [
-        {
-            "id": letter.id,
-            "type": letter.type,
-            "content": letter.content,
-            "generated_at": letter.generated_at,
-            "filename": letter.filename
-        }
-        for letter in letters
-    ]
+    def build_response():
+        letters = dbs.get_letter_rows(LETTER_FIELDS, user_id=user.id)
+        return json_response({"letters": rows_to_dicts(letters, LETTER_FIELDS)})
 
-    return jsonify({"letters": letter_list})
+    count, last_updated = dbs.get_letters_version(user.id)
+    return _cached_response(_version_tag('letters', user.id, count, last_updated), build_response)
 
 
-@app.route('/user_letters/<letter_id>', methods=['GET'])
+@api.route('/user_letters/<letter_id>', methods=['GET'])
 def get_user_letter(letter_id):
     user_cookie = request.cookies.get("session_id", None)
     if user_cookie is None:
@@ -276,13 +367,14 @@ def get_user_letter(letter_id):
             "filename": letter.filename
         }
 
-        return jsonify({"letter": letter_data})
+        return _cached_response(_version_tag('letter', letter.id, letter.updated_at),
+                                lambda: jsonify({"letter": letter_data}))
 
     except NoResultFound:
         return jsonify({"message": "Letter not found"}), 404
 
 
-@app.route('/download_save_letter/<letter_id>', methods=['GET'])
+@api.route('/download_save_letter/<letter_id>', methods=['GET'])
 def download_sava_letter(letter_id):
     user_cookie = request.cookies.get("session_id", None)
     if user_cookie is None:
@@ -300,15 +392,11 @@ def download_sava_letter(letter_id):
     if letter.user_id != user.id and not user.is_admin:
         return jsonify({"message": "User not authorized to download this letter"}), 403
 
-    context = json.loads(letter.content)
-    file_id = str(uuid.uuid4())
-    context_storage[file_id] = context
-
-    download_url = url_for('download_generated_letter', file_id=file_id, template_name=letter.type, _external=True)
+    download_url = _issue_download(letter.id, letter.type, json.loads(letter.content))
     return jsonify({"message": "Document ready for download", "download_url": download_url})
 
 
-@app.route('/letter/<letter_id>', methods=['DELETE'], strict_slashes=False)
+@api.route('/letter/<letter_id>', methods=['DELETE'], strict_slashes=False)
 def delete_user_letter(letter_id: str) -> tuple[Response, int]:
     """ DELETE /letter/<letter_id> """
     user_cookie = request.cookies.get("session_id", None)
@@ -334,7 +422,7 @@ def delete_user_letter(letter_id: str) -> tuple[Response, int]:
         return jsonify({"message": str(e)}), 500
 
 
-@app.route('/update_letter/<letter_id>', methods=['PUT'])
+@api.route('/update_letter/<letter_id>', methods=['PUT'])
 def update_letter(letter_id):
     user_cookie = request.cookies.get("session_id", None)
     if user_cookie is None:
@@ -369,7 +457,8 @@ def update_letter(letter_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/admin/login', methods=['POST'], strict_slashes=False)
+@api.route('/admin/login', methods=['POST'], strict_slashes=False)
+@limiter.limit(ip='10/minute')
 def admin_login():
     """ POST /admin/login """
     data = request.get_json()
@@ -392,7 +481,7 @@ def admin_login():
         return jsonify({"message": "Invalid credentials"}), 401
 
 
-@app.route('/admin/users', methods=['GET'], strict_slashes=False)
+@api.route('/admin/users', methods=['GET'], strict_slashes=False)
 def get_all_users() -> tuple[Response, int]:
     """ GET /admin/users """
     admin_cookie = request.cookies.get("session_id", None)
@@ -400,14 +489,44 @@ def get_all_users() -> tuple[Response, int]:
     if admin_user is None or admin_user.email != ADMIN_EMAIL:
         abort(403, description="Admin privileges required")
 
-    users = AUTH.get_all_users()
-    return jsonify(users), 200
+    users = AUTH.get_all_users(snapshot=True)
+    return json_response(users)
+
 
+@api.route('/admin/stats', methods=['GET'], strict_slashes=False)
+def get_stats() -> tuple[Response, int]:
+    """ GET /admin/stats?days=30 """
+    admin_cookie = request.cookies.get("session_id", None)
+    admin_user = AUTH.get_user_from_session_id(admin_cookie)
+    if admin_user is None or admin_user.email != ADMIN_EMAIL:
+        abort(403, description="Admin privileges required")
 
-@app.route('/admin/user', methods=['POST'], strict_slashes=False)
+    days = min(max(request.args.get("days", 30, type=int), 1), 366)
+    today = datetime.utcnow().date()
+    counters = dbs.get_stat_counters(since=(today - timedelta(days=days - 1)).isoformat())
+    users = counters.get("users", {})
+    by_type = counters.get("letter_type", {})
+    active = counters.get("active_day", {})
+    return jsonify({
+        "users": {
+            "total": users.get("total", 0),
+            "verified": users.get("verified", 0),
+            "logged_in": AUTH.count_logged_in_users(),
+            "active_today": active.get(today.isoformat(), 0),
+        },
+        "daily_active_users": active,
+        "letters": {
+            "total": sum(by_type.values()),
+            "by_type": by_type,
+            "by_district": counters.get("letter_district", {}),
+            "by_day": counters.get("letter_day", {}),
+        },
+    }), 200
+
+
+@api.route('/admin/user', methods=['POST'], strict_slashes=False)
 def get_user() -> tuple[Response, int]:
     """ POST /admin/user """
-    global user
     admin_cookie = request.cookies.get("session_id", None)
     admin_user = AUTH.get_user_from_session_id(admin_cookie)
     if admin_user is None or admin_user.email != ADMIN_EMAIL:
@@ -422,9 +541,9 @@ def get_user() -> tuple[Response, int]:
         return jsonify({"message": "Please provide a user ID or last name"}), 400
 
     if user_id:
-        user = dbs.get_user_by_id(user_id)
+        user = dbs.get_user_by_id(user_id, snapshot=True)
     elif last_name:
-        user = dbs.get_user_by_last_name(last_name)
+        user = dbs.get_user_by_last_name(last_name, snapshot=True)
 
     if user is None:
         return jsonify({"message": "User not found"}), 404
@@ -432,34 +551,49 @@ def get_user() -> tuple[Response, int]:
     return jsonify(user), 200
 
 
-@app.route('/admin/letters', methods=['GET'])
-def get_all_letters():
+@api.route('/admin/import_users', methods=['POST'], strict_slashes=False)
+def import_users() -> Response:
+    """ POST /admin/import_users with a CSV or JSONL file of teachers; streams NDJSON progress """
     admin_cookie = request.cookies.get("session_id", None)
     admin_user = AUTH.get_user_from_session_id(admin_cookie)
     if admin_user is None or admin_user.email != ADMIN_EMAIL:
         abort(403, description="Admin privileges required")
 
-    letters = dbs.get_all_letters()
-    letter_list = [
-        {
-            "id": letter.id,
-            "user_id": letter.user_id,
-            "user_first_name": letter.user_first_name,
-            "user_last_name": letter.user_last_name,
-            "type": letter.type,
-            "content": letter.content,
-            "generated_at": letter.generated_at
-        }
-        for letter in letters
-    ]
+    upload = request.files.get("file")
+    if upload is not None:
+        fmt = importer.format_for(upload.filename or "", upload.mimetype)
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    elif request.content_length:
+        fmt = importer.format_for("", request.mimetype)
+        stream = io.StringIO(request.get_data(as_text=True), newline="")
+    else:
+        return jsonify({"message": "Upload a CSV or JSONL file of teachers"}), 400
+
+    rows = list(importer.read_teachers(stream, fmt))
+    chunk_size = request.args.get("chunk_size", 500, type=int)
 
-    return jsonify({"letters": letter_list})
+    def generate():
+        for event in importer.import_teachers(AUTH, dbs, rows, chunk_size=max(1, chunk_size)):
+            yield json.dumps(event) + "\n"
 
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-@app.route('/admin/letter', methods=['POST'], strict_slashes=False)
+
+@api.route('/admin/letters', methods=['GET'])
+def get_all_letters():
+    admin_cookie = request.cookies.get("session_id", None)
+    admin_user = AUTH.get_user_from_session_id(admin_cookie)
+    if admin_user is None or admin_user.email != ADMIN_EMAIL:
+        abort(403, description="Admin privileges required")
+
+    letters = dbs.get_letter_rows(ADMIN_LETTER_FIELDS, snapshot=True)
+    return json_response({"letters": rows_to_dicts(letters, ADMIN_LETTER_FIELDS)})
+
+
+@api.route('/admin/letter', methods=['POST'], strict_slashes=False)
 def get_one_user_letters() -> tuple[Response, int]:
     """ POST /admin/letters """
-    global user
     admin_cookie = request.cookies.get("session_id", None)
     admin_user = AUTH.get_user_from_session_id(admin_cookie)
     if admin_user is None or admin_user.email != ADMIN_EMAIL:
@@ -473,32 +607,19 @@ def get_one_user_letters() -> tuple[Response, int]:
         return jsonify({"message": "Please provide a user ID or last name"}), 400
 
     if user_id:
-        user = dbs.get_letters_by_user_by_id(user_id)
+        user = dbs.get_letters_by_user_by_id(user_id, snapshot=True)
     elif last_name:
-        user = dbs.get_letters_by_user_by_last_name(last_name)
+        user = dbs.get_letters_by_user_by_last_name(last_name, snapshot=True)
 
     if user is None:
         return jsonify({"message": "User not found"}), 404
 
-    letters = dbs.get_letters_by_user(user.id)
-    letter_list = [
-        {
-            "id": letter.id,
-            "user_id": letter.user_id,
-            "user_first_name": letter.user_first_name,
-            "user_last_name": letter.user_last_name,
-            "type": letter.type,
-            "content": letter.content,
-            "generated_at": letter.generated_at,
-            "filename": letter.filename
-        }
-        for letter in letters
-    ]
-
-    return jsonify({"letters": letter_list}), 200
+    fields = ADMIN_LETTER_FIELDS + ("filename",)
+    letters = dbs.get_letter_rows(fields, user_id=user.id, snapshot=True)
+    return json_response({"letters": rows_to_dicts(letters, fields)})
 
 
-@app.route('/admin/letter/<letter_id>', methods=['DELETE'], strict_slashes=False)
+@api.route('/admin/letter/<letter_id>', methods=['DELETE'], strict_slashes=False)
 def delete_letter(letter_id: str) -> tuple[Response, int]:
     """ DELETE /admin/letter/<letter_id> """
     admin_cookie = request.cookies.get("session_id", None)
@@ -515,74 +636,64 @@ def delete_letter(letter_id: str) -> tuple[Response, int]:
         return jsonify({"message": str(e)}), 500
 
 
-@app.route('/generate_examination_questions', methods=['POST'])
-def generate_examination_questions():
-    user_cookie = request.cookies.get("session_id", None)
-    if user_cookie is None:
-        return jsonify({"message": "Session ID not found"}), 403
+# Shuffled papers per /examination_variants request
+EXAM_MAX_VARIANTS = int(os.getenv('EXAM_MAX_VARIANTS', '10'))
 
-    user = AUTH.get_user_from_session_id(user_cookie)
-    if user is None:
-        return jsonify({"message": "User not authenticated"}), 403
+# Shared by the buffered and streaming routes so both draw on the same buckets and generation slots
+EXAM_LIMITS = dict(group='generate_examination_questions',
+                   max_concurrent=int(os.getenv('MAX_CONCURRENT_GENERATIONS', '4')),
+                   user='10/hour', ip='30/hour', total='60/minute')
 
-    data = request.get_json()
+# 'multi' sends separate question and answer prompts; 'structured' asks for everything in one JSON response
+EXAM_GENERATION_MODE = os.getenv('EXAM_GENERATION_MODE', 'multi')
 
-    required_keys = [
-        'school_name', 'term', 'subject', 'class', 'duration', 'topics_taught', 'num_of_mul_choice_ques',
-        'num_of_subjective_ques', 'num_of_sub_ques_to_ans'
-    ]
+EXAM_REQUIRED_KEYS = [
+    'school_name', 'term', 'subject', 'class', 'duration', 'topics_taught', 'num_of_mul_choice_ques',
+    'num_of_subjective_ques', 'num_of_sub_ques_to_ans'
+]
 
-    if not all(key in data for key in required_keys):
-        return jsonify({"error": "Missing one or more required parameters"}), 400
 
-    school_name = data['school_name'].upper()
-    term = data['term'].upper()
+def _exam_sections(data: dict) -> list:
+    """ (questions key, answers key, questions prompt, answers prompt builder) for each exam section """
     subject = data['subject'].upper()
     level = data['class'].upper()
-    duration = data['duration'].upper()
     topics_taught = data['topics_taught']
-    num_of_mul_choice_ques = data['num_of_mul_choice_ques']
-    num_of_subjective_ques = data['num_of_subjective_ques']
-    num_of_sub_ques_to_ans = data['num_of_sub_ques_to_ans']
-
-    model = genai.GenerativeModel('gemini-1.5-flash')
-
-    mul_ques_response = model.generate_content(
-        f"Generate {num_of_mul_choice_ques} multiple choice questions on {subject} for "
-        f"{level} learners in the Ghana curriculum covering these topics: {topics_taught}. "
-        f"Generate only standard multiple choice questions, do not bold anything, do not add anything and do "
-        f"not separate them under topics. The options should be vertical."
-    )
-
-    subjective_ques_response = model.generate_content(
-        f"Generate {num_of_subjective_ques} subjective questions on {subject} for "
-        f"{level} learners in the Ghana curriculum covering these topics: {topics_taught}. "
-        f"Generate only subjective questions, do not add anything and do not separate them under topics do not add "
-        f"anything and do not separate them under topics."
-    )
-
-    mul_choice_ques_ans_response = model.generate_content(
-        f"Provide answers with their respective numbers for the following multiple choice questions: "
-        f"{mul_ques_response.text}. Generate only the answers."
-    )
-
-    sub_ques_ans_response = model.generate_content(
-        f"Provide answers with their respective numbers for the following subjective questions: "
-        f"{subjective_ques_response.text}. Generate only subjective answers, do not bold anything, do not add "
-        f"anything and do not separate them under topics."
-    )
+    return [
+        (
+            "MUL_CHOICE_QUES", "MARKING_SCHEME_SEC_A",
+            f"Generate {data['num_of_mul_choice_ques']} multiple choice questions on {subject} for "
+            f"{level} learners in the Ghana curriculum covering these topics: {topics_taught}. "
+            f"Generate only standard multiple choice questions, do not bold anything, do not add anything and do "
+            f"not separate them under topics. The options should be vertical.",
+            lambda questions: f"Provide answers with their respective numbers for the following multiple choice "
+                              f"questions: {questions}. Generate only the answers."
+        ),
+        (
+            "SUBJECTIVE_QUESTIONS", "MARKING_SCHEME_SEC_B",
+            f"Generate {data['num_of_subjective_ques']} subjective questions on {subject} for "
+            f"{level} learners in the Ghana curriculum covering these topics: {topics_taught}. "
+            f"Generate only subjective questions, do not add anything and do not separate them under topics do not "
+            f"add anything and do not separate them under topics.",
+            lambda questions: f"Provide answers with their respective numbers for the following subjective "
+                              f"questions: {questions}. Generate only subjective answers, do not bold anything, "
+                              f"do not add anything and do not separate them under topics."
+        ),
+    ]
+
 
+def _save_examination(user, data: dict, texts: dict) -> str:
+    """ Stores the generated questions and marking scheme as a letter and returns the download URL """
     context = {
-        "SCHOOL_NAME": school_name,
-        "TERM": term,
-        "SUBJECT": subject,
-        "CLASS": level,
-        "DURATION": duration,
-        "MUL_CHOICE_QUES": mul_ques_response.text,
-        "NUM_OF_QUES_TO_ANS": num_of_sub_ques_to_ans,
-        "SUBJECTIVE_QUESTIONS": subjective_ques_response.text,
-        "MARKING_SCHEME_SEC_A": mul_choice_ques_ans_response.text,
-        "MARKING_SCHEME_SEC_B": sub_ques_ans_response.text,
+        "SCHOOL_NAME": data['school_name'].upper(),
+        "TERM": data['term'].upper(),
+        "SUBJECT": data['subject'].upper(),
+        "CLASS": data['class'].upper(),
+        "DURATION": data['duration'].upper(),
+        "MUL_CHOICE_QUES": texts["MUL_CHOICE_QUES"],
+        "NUM_OF_QUES_TO_ANS": data['num_of_sub_ques_to_ans'],
+        "SUBJECTIVE_QUESTIONS": texts["SUBJECTIVE_QUESTIONS"],
+        "MARKING_SCHEME_SEC_A": texts["MARKING_SCHEME_SEC_A"],
+        "MARKING_SCHEME_SEC_B": texts["MARKING_SCHEME_SEC_B"],
     }
 
     # Generate filename
@@ -593,19 +704,100 @@ def generate_examination_questions():
     new_letter = dbs.add_letter(user_id=user.id, type='examination_questions', content=letter_content,
                                 filename=filename)
 
-    # Generate file ID for download
-    file_id = str(uuid.uuid4())
-    context_storage[file_id] = context
+    return _issue_download(new_letter.id, 'examination_questions', context)
+
+
+async def _questions_with_answers(model, questions_prompt: str, answers_prompt, stats: exam.GenerationStats) \
+        -> tuple[str, str]:
+    """ Generates a set of questions, then the answers for those questions """
+    # The blocking client runs in a thread: genai's asyncio client stays bound to the first
+    # event loop it ran on, and each async view runs on a fresh loop that is closed afterwards.
+    # The view itself still holds its WSGI thread; the gain is that both chains overlap.
+    questions_response = await asyncio.to_thread(model.generate_content, questions_prompt)
+    stats.add(questions_response)
+    answers_response = await asyncio.to_thread(model.generate_content, answers_prompt(questions_response.text))
+    stats.add(answers_response)
+    return questions_response.text, answers_response.text
+
+
+async def _generate_multi_call(model, data: dict, stats: exam.GenerationStats) -> dict:
+    """ One prompt per question set and one per marking scheme """
+    # The multiple choice and subjective chains do not depend on each other, so
+    # run them concurrently; each answer prompt still waits for its questions.
+    sections = _exam_sections(data)
+    results = await asyncio.gather(*(
+        _questions_with_answers(model, questions_prompt, answers_prompt, stats)
+        for _, _, questions_prompt, answers_prompt in sections
+    ))
+    texts = {}
+    for (questions_key, answers_key, _, _), (questions, answers) in zip(sections, results):
+        texts[questions_key] = questions
+        texts[answers_key] = answers
+    return texts
+
+
+async def _generate_structured(model, data: dict, stats: exam.GenerationStats) -> dict:
+    """ A single schema-constrained call returning questions and marking scheme together """
+    response = await asyncio.to_thread(model.generate_content, exam.structured_prompt(data),
+                                       generation_config=exam.STRUCTURED_GENERATION_CONFIG)
+    stats.add(response)
+    return exam.parse_structured(response.text, data)
+
+
+def _stream_text(model, prompt: str, section: str, parts: list):
+    """ Yields NDJSON deltas for one prompt as the model produces them, collecting the text in `parts` """
+    for chunk in model.generate_content(prompt, stream=True):
+        parts.append(chunk.text)
+        yield json.dumps({"event": "delta", "section": section, "text": chunk.text}) + "\n"
+
+
+@api.route('/generate_examination_questions', methods=['POST'])
+@idempotency.idempotent()
+@limiter.limit(**EXAM_LIMITS)
+async def generate_examination_questions():
+    user_cookie = request.cookies.get("session_id", None)
+    if user_cookie is None:
+        return jsonify({"message": "Session ID not found"}), 403
 
-    # Generate download URL
-    download_url = url_for('download_generated_letter', file_id=file_id, template_name='examination_questions',
-                           _external=True)
+    user = AUTH.get_user_from_session_id(user_cookie)
+    if user is None:
+        return jsonify({"message": "User not authenticated"}), 403
 
-    return jsonify({"message": "Examination document created successfully", "download_url": download_url})
+    data = request.get_json()
 
+    if not all(key in data for key in EXAM_REQUIRED_KEYS):
+        return jsonify({"error": "Missing one or more required parameters"}), 400
 
-@app.route('/generate_letter', methods=['POST'])
-def generate_letter():
+    mode = data.get('generation_mode', EXAM_GENERATION_MODE)
+    if mode not in ('multi', 'structured'):
+        return jsonify({"error": "generation_mode must be 'multi' or 'structured'"}), 400
+
+    model = llm.get_model()
+    stats = exam.GenerationStats(mode)
+    started = time.perf_counter()
+
+    texts = None
+    if mode == 'structured':
+        try:
+            texts = await _generate_structured(model, data, stats)
+        except ValueError as e:
+            current_app.logger.warning("Structured exam generation failed, falling back to multi-call: %s", e)
+            stats.mode = 'structured_fallback'
+    if texts is None:
+        texts = await _generate_multi_call(model, data, stats)
+
+    stats.latency_ms = (time.perf_counter() - started) * 1000
+    current_app.logger.info("Exam generation %s", stats.to_dict())
+
+    download_url = _save_examination(user, data, texts)
+    return jsonify({"message": "Examination document created successfully", "download_url": download_url,
+                    "generation": stats.to_dict()})
+
+
+@api.route('/generate_examination_questions/stream', methods=['POST'])
+@limiter.limit(**EXAM_LIMITS)
+def stream_examination_questions():
+    """ POST /generate_examination_questions/stream """
     user_cookie = request.cookies.get("session_id", None)
     if user_cookie is None:
         return jsonify({"message": "Session ID not found"}), 403
@@ -615,138 +807,152 @@ def generate_letter():
         return jsonify({"message": "User not authenticated"}), 403
 
     data = request.get_json()
-    letter_type = data.get('letter_type')
 
-    required_keys_map = {
-        'maternity_leave_letter': ['name', 'staffid', 'phone', 'registeredno', 'school', 'address', 'district_town',
-                                   'address_town', 'district', 'date_on_letter'],
-        'upgrading_application_letter': ['name', 'staffid', 'phone', 'registeredno', 'school', 'address',
-                                         'district_town',
-                                         'address_town', 'district', 'date_on_letter', 'years_in_service', 'program',
-                                         'year_completed', 'current_rank', 'next_rank'],
-        'acceptance_of_appointment_letter': ['name', 'reference', 'phone', 'school', 'address', 'region_town',
-                                             'address_town', 'region', 'date_on_letter', 'date_on_appointment_letter'],
-        'transfer_or_reposting_letter': ['name', 'staffid', 'phone', 'registeredno', 'school', 'address',
-                                         'district_town',
-                                         'address_town', 'district', 'date_on_letter', 'years_in_school', 'reason',
-                                         'new_school'],
-        'release_transfer_letter': ['name', 'staffid', 'phone', 'registeredno', 'school', 'address', 'district_town',
-                                    'address_town', 'district', 'date_on_letter', 'years_in_school', 'reason',
-                                    'new_dist_reg', 'curr_dist_reg', 'level_of_transfer'],
-        'salary_reactivation_letter': ['name', 'staffid', 'phone', 'registeredno', 'school', 'address', 'district_town',
-                                       'address_town', 'district', 'date_on_letter', 'month_or_s', 'circuit']
-    }
+    if not all(key in data for key in EXAM_REQUIRED_KEYS):
+        return jsonify({"error": "Missing one or more required parameters"}), 400
 
-    if letter_type not in required_keys_map:
-        return jsonify({"error": "Invalid letter type"}), 400
+    model = llm.get_model()
+    sections = _exam_sections(data)
+
+    def generate():
+        yield json.dumps({"event": "start"}) + "\n"
+        texts = {}
+        try:
+            for questions_key, answers_key, questions_prompt, answers_prompt in sections:
+                parts = []
+                yield from _stream_text(model, questions_prompt, questions_key, parts)
+                texts[questions_key] = "".join(parts)
+                parts = []
+                yield from _stream_text(model, answers_prompt(texts[questions_key]), answers_key, parts)
+                texts[answers_key] = "".join(parts)
+        except Exception as e:
+            yield json.dumps({"event": "error", "message": str(e)}) + "\n"
+            return
+
+        download_url = _save_examination(user, data, texts)
+        yield json.dumps({"event": "done", "message": "Examination document created successfully",
+                          "download_url": download_url}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@api.route('/examination_variants/<letter_id>', methods=['POST'])
+@limiter.limit(ip='60/hour', user='20/hour')
+def examination_variants(letter_id):
+    """ POST /examination_variants/<letter_id> with {"variants": 3, "seed": "..."} returns a ZIP of shuffled papers """
+    user_cookie = request.cookies.get("session_id", None)
+    if user_cookie is None:
+        return jsonify({"message": "Session ID not found"}), 403
 
-    required_keys = required_keys_map[letter_type]
+    user = AUTH.get_user_from_session_id(user_cookie)
+    if user is None:
+        return jsonify({"message": "User not authenticated"}), 403
 
-    if not all(key in data for key in required_keys):
-        return jsonify({"error": "Missing one or more required parameters"}), 400
+    try:
+        letter = dbs.get_letter(letter_id)
+    except NoResultFound:
+        return jsonify({"message": "Letter not found"}), 404
 
-    original_date = datetime.strptime(data['date_on_letter'], "%Y-%m-%d")
-    formatted_date_str = original_date.strftime("%B %d, %Y")
-
-    context = {}
-    if letter_type == 'acceptance_of_appointment_letter':
-        context = {
-            "NAME": data['name'].upper(),
-            "SCHOOLNAME": data['school'],
-            "ADDRESS": data['address'],
-            "ADDRESSTOWN": data['address_town'].upper(),
-            "TOWN": data['region_town'].upper(),
-            "PHONE": f"({data['phone']})",
-            "DATEONLETTER": formatted_date_str.upper()
-        }
-    else:
-        context = {
-            "NAME": data['name'].upper(),
-            "SCHOOLNAME": data['school'],
-            "ADDRESS": data['address'],
-            "ADDRESSTOWN": data['address_town'].upper(),
-            "TOWN": data['district_town'].upper(),
-            "STAFFID": data['staffid'],
-            "REGISTERNO": data['registeredno'],
-            "PHONE": f"({data['phone']})",
-            "DATEONLETTER": formatted_date_str.upper(),
-            "DISTRICT": data['district'].upper()
-        }
+    if letter.user_id != user.id and not user.is_admin:
+        return jsonify({"message": "User not authorized to download this letter"}), 403
+    if letter.type != 'examination_questions':
+        return jsonify({"error": "Variants can only be made from examination questions"}), 400
+
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('variants', 2))
+    except (TypeError, ValueError):
+        count = 0
+    if not 2 <= count <= EXAM_MAX_VARIANTS:
+        return jsonify({"error": f"variants must be between 2 and {EXAM_MAX_VARIANTS}"}), 400
+    seed = str(data.get('seed', letter.id))
 
-    if letter_type == 'upgrading_application_letter':
-        context.update({
-            "NUMBEROFYEARSINSERVICE": data['years_in_service'],
-            "NAMEOFPROGRAM": data['program'].title(),
-            "YEARCOMPLETED": data['year_completed'],
-            "CURRENTRANK": data['current_rank'],
-            "NEXTRANK": data['next_rank'],
-            "NEXTRANKTITLE": data['next_rank'].upper()
-        })
-
-    elif letter_type == 'acceptance_of_appointment_letter':
-        appointment_date_original = datetime.strptime(data['date_on_appointment_letter'], "%Y-%m-%d")
-        appointment_date_formatted = appointment_date_original.strftime("%B %d, %Y")
-        context.update({
-            "REFERENCEAPPOINTMENTLETTER": data['reference'],
-            "DATEONTHEAPPOINTMENTLETTER": appointment_date_formatted.title(),
-            "REGION": data['region'].upper()
-        })
-
-    elif letter_type == 'transfer_or_reposting_letter':
-        context.update({
-            "NUMBEROFYEARSSERVED": data['years_in_school'],
-            "NEWSCHOOLNAME": data['new_school'].title(),
-            "REASON": data['reason'].lower()
-        })
-
-    elif letter_type == 'release_transfer_letter':
-        context.update({
-            "NUMBEROFYEARSSERVED": data['years_in_school'],
-            "NEWDISTORREG": data['new_dist_reg'].title(),
-            "CURRENTDISTORREG": data['curr_dist_reg'].title(),
-            "LEVELOFTRANSFER": data['level_of_transfer'].title(),
-            "REASON": data['reason'].lower()
-        })
-
-    elif letter_type == 'salary_reactivation_letter':
-        context.update({
-            "YOURDISTRICT": data['district'].title(),
-            "MONTHORS": data['month_or_s'],
-            "CIRCUITNAME": data['circuit'].title()
-        })
-
-    file_id = str(uuid.uuid4())
-    context_storage[file_id] = context
-
-    filename = f"{letter_type.replace('_', ' ').title()} for {context['NAME']}.docx"
+    context = json.loads(letter.content)
+    try:
+        questions = exam.parse_multiple_choice(context["MUL_CHOICE_QUES"], context["MARKING_SCHEME_SEC_A"])
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Could not read the multiple choice questions: {e}"}), 422
+
+    # Every paper comes from the one stored generation; only the order of questions and options differs
+    papers = {}
+    for label in string.ascii_uppercase[:count]:
+        mul_choice, marking_scheme = exam.format_multiple_choice(
+            exam.shuffle_multiple_choice(questions, f"{seed}:{label}"))
+        papers[label] = dict(context, SUBJECT=f"{context['SUBJECT']} (PAPER {label})", MUL_CHOICE_QUES=mul_choice,
+                             MARKING_SCHEME_SEC_A=marking_scheme)
+    for paper in papers.values():
+        artifacts.submit(letter.id, 'examination_questions', paper)
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for label, paper in papers.items():
+            name = artifacts.get(letter.id, 'examination_questions', paper)
+            archive.write(artifacts.path(name), f"Paper {label} - {letter.filename}")
+    buffer.seek(0)
+    return send_file(buffer, mimetype="application/zip", as_attachment=True,
+                     download_name=f"{os.path.splitext(letter.filename)[0]}_Papers.zip")
+
+
+@api.route('/generate_letter', methods=['POST'])
+@idempotency.idempotent()
+def generate_letter():
+    user_cookie = request.cookies.get("session_id", None)
+    if user_cookie is None:
+        return jsonify({"message": "Session ID not found"}), 403
+
+    user = AUTH.get_user_from_session_id(user_cookie)
+    if user is None:
+        return jsonify({"message": "User not authenticated"}), 403
+
+    data = request.get_json()
+    letter_type = data.get('letter_type')
+
+    letter = LETTER_TYPES.get(letter_type)
+    if letter is None:
+        return jsonify({"error": "Invalid letter type"}), 400
+
+    try:
+        context = letter.build_context(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filename = f"{letter.title} for {context['NAME']}.docx"
     letter_content = json.dumps(context)
     new_letter = dbs.add_letter(user_id=user.id, type=letter_type, content=letter_content, filename=filename)
 
-    download_url = url_for('download_generated_letter', file_id=file_id, template_name=letter_type, _external=True)
+    download_url = _issue_download(new_letter.id, letter_type, context)
     return jsonify(
-        {"message": f"{letter_type.replace('_', ' ').title()} generated successfully", "download_url": download_url})
+        {"message": f"{letter.title} generated successfully", "download_url": download_url})
 
 
-@app.route('/download_generated_letter/<file_id>/<template_name>', methods=['GET'])
+@api.route('/download_generated_letter/<file_id>/<template_name>', methods=['GET'])
 def download_generated_letter(file_id, template_name):
-    if file_id not in context_storage:
+    # The cache copy expires with the token; the database answers when this node never saw it
+    cached = cache.get(f"download:{file_id}")
+    if cached is not None:
+        cached_template, context, letter_id = json.loads(cached)
+        token = (context, letter_id) if cached_template == template_name else None
+    else:
+        token = dbs.get_download_token(file_id, template_name)
+    if token is None:
         return jsonify({"error": "Invalid file ID"}), 404
+    context, letter_id = token
 
-    context = context_storage.pop(file_id)
-    template_path = f"letter_templates/{template_name}.docx"
-    doc = DocxTemplate(template_path)
-    doc.render(context)
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp_file:
-        doc.save(tmp_file.name)
-        tmp_file_path = tmp_file.name
+    # Usually rendered already, or still rendering since the link was issued. The token is only
+    # found for ids we issued, so its letter id is safe to use in a path.
+    name = artifacts.get(letter_id or file_id, template_name, context)
 
     # Determine the appropriate name field
     name_field = context.get("NAME", context.get("SCHOOL_NAME", "Document"))
 
-    return send_file(tmp_file_path, as_attachment=True,
-                     download_name=f"{template_name.replace('_', ' ').title()} for {name_field.title()}.docx")
+    # The file name changes with the rendered content, so it is a strong ETag and send_file
+    # can answer Range, If-Range and If-None-Match requests from the stored file
+    response = send_file(artifacts.path(name), as_attachment=True, conditional=True, etag=name,
+                         download_name=f"{template_name.replace('_', ' ').title()} for {name_field.title()}.docx")
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
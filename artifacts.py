@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+from letter_types import template_path
+from rate_limit import TooManyRequests
+
+logger = logging.getLogger(__name__)
+
+
+def render_docx(template_name: str, context: dict, path: str) -> None:
+    """ Renders a template into `path`, writing a temp file first so readers never see a partial document """
+    from docxtpl import DocxTemplate
+    doc = DocxTemplate(template_path(template_name))
+    doc.render(context)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx", dir=os.path.dirname(path)) as tmp_file:
+        doc.save(tmp_file.name)
+    os.replace(tmp_file.name, path)
+
+
+class ArtifactStore:
+    """
+    Rendered documents on disk, named after the letter they belong to and a digest of the
+    render context, so an edited letter gets a new file. Renders run on a small thread pool,
+    letting generation start one before the client asks for the download. A download that
+    arrives first waits for that render rather than starting another, through its future in
+    this worker or a lock file when another worker is rendering.
+    """
+
+    def __init__(self, directory: str, workers: int = 2, wait_seconds: float = 60):
+        self.directory = directory
+        self.wait_seconds = wait_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    @staticmethod
+    def name(key: str, template_name: str, context: dict) -> str:
+        digest = hashlib.sha256(json.dumps([template_name, context], sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{key}.{digest[:16]}"
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.docx")
+
+    def submit(self, key: str, template_name: str, context: dict) -> Future:
+        """ Starts rendering the document unless it is already on disk or being rendered """
+        name = self.name(key, template_name, context)
+        with self._lock:
+            future = self._inflight.get(name)
+            if future is not None:
+                return future
+            if os.path.exists(self.path(name)):
+                future = Future()
+                future.set_result(name)
+                return future
+            future = self._executor.submit(self._render, name, template_name, context)
+            self._inflight[name] = future
+        future.add_done_callback(lambda done: self._forget(name, done))
+        return future
+
+    def get(self, key: str, template_name: str, context: dict) -> str:
+        """ The name of the rendered document, waiting up to wait_seconds for its render """
+        try:
+            return self.submit(key, template_name, context).result(timeout=self.wait_seconds)
+        except TimeoutError:
+            raise TooManyRequests("Document is still being prepared. Please try again shortly.", 5, status_code=503)
+
+    def _forget(self, name: str, future: Future) -> None:
+        with self._lock:
+            self._inflight.pop(name, None)
+        if future.exception() is not None:
+            logger.error("Rendering %s failed", name, exc_info=future.exception())
+
+    def _render(self, name: str, template_name: str, context: dict) -> str:
+        path = self.path(name)
+        lock_path = f"{path}.lock"
+        os.makedirs(self.directory, exist_ok=True)
+        while not os.path.exists(path):
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                # Another worker is rendering it; a lock older than wait_seconds was left by one that died
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > self.wait_seconds:
+                        os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                time.sleep(0.05)
+                continue
+            try:
+                if not os.path.exists(path):
+                    render_docx(template_name, context, path)
+            finally:
+                os.remove(lock_path)
+        return name
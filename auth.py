@@ -4,28 +4,40 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from jinja2 import Template
 import random
-from bcrypt import hashpw, gensalt, checkpw
 from constant import template_for_password_reset, template_for_email_verification
 from db import DB
+from serializers import ADMIN_USER_FIELDS, rows_to_dicts
+from tokens import TokenSigner, TokenUser
 from user import User
 from sqlalchemy.orm.exc import NoResultFound
 from uuid import uuid4
-from datetime import datetime
-from dotenv import load_dotenv
-
-load_dotenv()
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 
 class Auth:
-    def __init__(self):
-        self._db = DB()
+    def __init__(self, db: DB = None, cache=None):
+        self._db = db if db is not None else DB()
         self.SMTP_SERVER = os.getenv('SMTP_SERVER')
         self.SMTP_PORT = 465
         self.SMTP_EMAIL = os.getenv('SMTP_EMAIL')
         self.SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+        self.BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+        self.SESSION_DURATION = timedelta(hours=float(os.getenv('SESSION_DURATION_HOURS', '3')))
+        # 'db' keeps sessions in the sessions table; 'stateless' issues signed tokens checked without a DB read
+        self.AUTH_MODE = os.getenv('AUTH_MODE', 'db')
+        self._tokens = None
+        if self.AUTH_MODE == 'stateless':
+            self._tokens = TokenSigner(os.getenv('SECRET_KEY'), self._db,
+                                       float(os.getenv('TOKEN_REVOCATION_REFRESH_SECONDS', '5')), cache)
 
     def _hash_password(self, password: str) -> str:
-        return hashpw(password.encode('utf-8'), gensalt()).decode('utf-8')
+        from bcrypt import hashpw, gensalt
+        return hashpw(password.encode('utf-8'), gensalt(self.BCRYPT_ROUNDS)).decode('utf-8')
+
+    def _check_password(self, password: str, hashed_password: str) -> bool:
+        from bcrypt import checkpw
+        return checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
     def _generate_uuid(self) -> str:
         return str(uuid4())
@@ -67,15 +79,40 @@ class Auth:
             return new_user
 
     def send_verification_email(self, email: str, first_name: str, verification_code: str):
-        subject = 'Email Verification'
+        message = self.verification_email(email, first_name, verification_code)
+        self._send_email(email, message["subject"], message["body"])
+
+    def verification_email(self, email: str, first_name: str, verification_code: str) -> dict:
+        """ The verification email as an outbox row """
         template = template_for_email_verification
         context = {
             "first_name": first_name,
             "email": email,
             "verification_code": verification_code
         }
-        body_html = self.render_template(template, context)
-        self._send_email(email, subject, body_html)
+        return {"to_email": email, "subject": 'Email Verification', "body": self.render_template(template, context)}
+
+    def hash_passwords(self, passwords: list, workers: int = None) -> list:
+        """ Hashes many passwords at once; bcrypt releases the GIL, so the threads run on every core """
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            return list(executor.map(self._hash_password, passwords))
+
+    def generate_verification_code(self) -> str:
+        return self._generate_reset_code()
+
+    def send_queued_emails(self, batch_size: int = 50) -> int:
+        """ Delivers emails queued in the outbox, returning how many were sent """
+        sent = 0
+        # Every worker runs this; each email is claimed by one of them before it is sent
+        for email in self._db.claim_pending_emails(batch_size):
+            try:
+                self._send_email(email.to_email, email.subject, email.body)
+            except ValueError as e:
+                self._db.mark_email_failed(email.id, str(e))
+            else:
+                self._db.mark_email_sent(email.id)
+                sent += 1
+        return sent
 
     def verify_user_email(self, email: str, verification_code: str) -> None:
         try:
@@ -86,35 +123,43 @@ class Auth:
         except NoResultFound:
             raise ValueError(f"User with email '{email}' not found")
 
-    def valid_login(self, email: str, password: str) -> bool:
-        try:
-            user = self._db.find_user_by(email=email)
+    def login(self, email: str, password: str) -> str:
+        """ Checks the password and issues a session in one transaction; returns None on bad credentials """
+        def verify(user) -> bool:
             if not user.is_verified:
                 raise ValueError(f"Email '{email}' is not verified. Please check your email for verification.")
-            return checkpw(password.encode('utf-8'), user.hashed_password.encode('utf-8'))
-        except NoResultFound:
-            return False
+            return self._check_password(password, user.hashed_password)
+
+        return self._start_session(email, verify)
 
     def create_session(self, email: str) -> str:
-        try:
-            user = self._db.find_user_by(email=email)
-            session_id = self._generate_uuid()
-            self._db.update_user(user.id, session_id=session_id, last_login=datetime.utcnow())
-            return session_id
-        except NoResultFound:
-            return None
+        return self._start_session(email)
+
+    def _start_session(self, email: str, verify=None) -> str:
+        if self._tokens is not None:
+            row = self._db.start_session(email, None, self.SESSION_DURATION, verify)
+            return self._tokens.issue(row.id, email, row.is_admin, self.SESSION_DURATION) if row else None
+        session_id = self._generate_uuid()
+        return session_id if self._db.start_session(email, session_id, self.SESSION_DURATION, verify) else None
 
     def get_user_from_session_id(self, session_id: str) -> User:
         if session_id is None:
             return None
-        try:
-            user = self._db.find_user_by(session_id=session_id)
-            return user
-        except NoResultFound:
-            return None
-
-    def destroy_session(self, user_id: int) -> None:
-        self._db.update_user(user_id, session_id=None)
+        if self._tokens is not None:
+            claims = self._tokens.verify(session_id)
+            return TokenUser(claims, lambda user_id: self._db.find_user_by(id=user_id)) if claims else None
+        return self._db.get_user_by_session(session_id, self.SESSION_DURATION)
+
+    def destroy_session(self, session_id: str) -> None:
+        if self._tokens is not None:
+            self._tokens.revoke(session_id)
+        else:
+            self._db.end_session(session_id)
+
+    def sweep_expired_sessions(self) -> int:
+        if self._tokens is not None:
+            return self._db.delete_expired_revocations()
+        return self._db.delete_expired_sessions()
 
     def forgot_password(self, email: str):
         try:
@@ -142,6 +187,10 @@ class Auth:
                 raise ValueError("Invalid reset code")
             hashed_password = self._hash_password(new_password)
             self._db.update_user(user.id, hashed_password=hashed_password, reset_code=None)
+            if self._tokens is not None:
+                self._tokens.revoke_user(user.id, self.SESSION_DURATION)
+            else:
+                self._db.end_user_sessions(user.id)
         except NoResultFound:
             raise ValueError(f"User with email '{email}' not found")
 
@@ -149,8 +198,17 @@ class Auth:
         self._db.update_user(user_id, first_name=first_name, last_name=last_name, phone_number=phone_number,
                              gender=gender)
 
-    def get_all_users(self) -> list:
-        users = self._db.get_all_users()
-        return [{"id": user.id, "email": user.email, "first_name": user.first_name, "last_name": user.last_name,
-                 "phone_number": user.phone_number, "gender": user.gender, "last_login": user.last_login,
-                 "is_logged_in": user.session_id is not None} for user in users]
+    def count_logged_in_users(self) -> int:
+        if self._tokens is not None:
+            return self._db.count_users_logged_in_since(datetime.utcnow() - self.SESSION_DURATION)
+        return self._db.count_logged_in_users()
+
+    def get_all_users(self, snapshot: bool = False) -> list:
+        users = rows_to_dicts(self._db.get_user_rows(ADMIN_USER_FIELDS, snapshot), ADMIN_USER_FIELDS)
+        if self._tokens is not None:
+            logged_in = self._db.get_users_logged_in_since(datetime.utcnow() - self.SESSION_DURATION, snapshot)
+        else:
+            logged_in = self._db.get_logged_in_user_ids(snapshot)
+        for user in users:
+            user["is_logged_in"] = user["id"] in logged_in
+        return users
@@ -0,0 +1,548 @@
+"""
+Load-test and micro-benchmark harness for the Teachers Assistant API.
+
+Boots `app` against a throwaway SQLite database with Gemini, SMTP and
+bcrypt cost stubbed out, seeds users and letters, drives a realistic
+request mix through the Flask test client and prints throughput and
+p50/p95/p99 latency per endpoint as JSON.
+
+    python benchmark.py --users 200 --letters 1000 --requests 500 --output bench.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+BENCH_PASSWORD = "bench-password"
+ADMIN_EMAIL = "admin@bench.local"
+ADMIN_PASSWORD = "admin-password"
+
+LETTER_PAYLOADS = {
+    'maternity_leave_letter': {},
+    'upgrading_application_letter': {
+        "years_in_service": "5", "program": "masters in education", "year_completed": "2020",
+        "current_rank": "Senior Teacher", "next_rank": "Principal Teacher"
+    },
+    'acceptance_of_appointment_letter': {
+        "reference": "Ref123", "region_town": "Ho", "region": "Volta", "date_on_appointment_letter": "2023-06-01"
+    },
+    'transfer_or_reposting_letter': {
+        "years_in_school": "3", "reason": "Family Relocation", "new_school": "new example school"
+    },
+    'release_transfer_letter': {
+        "years_in_school": "3", "reason": "New Job Opportunity", "new_dist_reg": "new district",
+        "curr_dist_reg": "current district", "level_of_transfer": "district level"
+    },
+    'salary_reactivation_letter': {"month_or_s": "January", "circuit": "example circuit"},
+}
+
+EXAM_PAYLOAD = {
+    "school_name": "Bench School", "term": "First", "subject": "Science", "class": "Basic 6",
+    "duration": "1 hour", "topics_taught": "Plants, Energy", "num_of_mul_choice_ques": 10,
+    "num_of_subjective_ques": 5, "num_of_sub_ques_to_ans": 3
+}
+
+
+class FakeUsage:
+    def __init__(self, prompt, text):
+        # Roughly four characters per token, as for English text
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(text) // 4
+
+
+class FakeResponse:
+    def __init__(self, text, prompt=""):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt, text)
+
+    def __iter__(self):
+        # Streamed responses arrive a line at a time
+        for line in self.text.splitlines(keepends=True):
+            yield FakeResponse(line)
+
+
+class FakeModel:
+    """ Stand-in for genai.GenerativeModel with a configurable delay """
+    latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _respond(self, prompt, generation_config=None):
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            num_mul_choice, num_subjective = (int(n) for n in re.findall(r"exactly (\d+)", prompt)[:2])
+            text = json.dumps({
+                "multiple_choice": [{"question": f"Multiple choice question {i} about the topics taught?",
+                                     "options": ["First option", "Second option", "Third option", "Fourth option"],
+                                     "answer": "ABCD"[i % 4]} for i in range(num_mul_choice)],
+                "subjective": [{"question": f"Explain subjective question {i} about the topics taught.",
+                                "answer": f"A model answer for subjective question {i}."}
+                               for i in range(num_subjective)],
+            })
+        else:
+            text = "\n".join(f"{i}. Question about {prompt[:40]}" for i in range(1, 11))
+        return FakeResponse(text, prompt)
+
+    def generate_content(self, prompt, stream=False, generation_config=None, **kwargs):
+        if stream:
+            return self._stream(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(prompt, generation_config)
+
+    def _stream(self, prompt):
+        # Spread the same total latency over the chunks, as a streaming model would
+        for i in range(1, 11):
+            if self.latency:
+                time.sleep(self.latency / 10)
+            yield FakeResponse(f"{i}. Question about {prompt[:40]}\n")
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    """ Collects per-endpoint latencies and the wall-clock window they ran in """
+
+    def __init__(self):
+        self._samples = {}
+
+    def record(self, label: str, started: float, finished: float, ok: bool) -> None:
+        entry = self._samples.setdefault(label, {"latencies": [], "errors": 0, "first": started, "last": finished})
+        entry["latencies"].append(finished - started)
+        entry["first"] = min(entry["first"], started)
+        entry["last"] = max(entry["last"], finished)
+        if not ok:
+            entry["errors"] += 1
+
+    def report(self) -> dict:
+        results = {}
+        for label, entry in self._samples.items():
+            latencies = sorted(entry["latencies"])
+            window = entry["last"] - entry["first"]
+            results[label] = {
+                "count": len(latencies),
+                "errors": entry["errors"],
+                "throughput_rps": round(len(latencies) / window, 2) if window > 0 else None,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            }
+        return results
+
+
+def reset_database(url: str) -> None:
+    """ Drops every table the app creates, so a reused database starts empty """
+    from sqlalchemy import text
+    from db import create_db_engine
+    from user import Base
+
+    engine = create_db_engine(url)
+    with engine.begin() as conn:
+        Base.metadata.drop_all(conn)
+        conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+    engine.dispose()
+
+
+def boot(workdir: str, llm_latency: float, auth_mode: str = "db", db_url: str = None):
+    """ Imports the app against a temp database (or a throwaway `db_url`) with external services stubbed """
+    os.environ["AUTH_MODE"] = auth_mode
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    if db_url:
+        reset_database(db_url)
+    os.environ["DATABASE_URL"] = db_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ["ADMIN_EMAIL"] = ADMIN_EMAIL
+    os.environ["ADMIN_PASSWORD"] = ADMIN_PASSWORD
+    os.environ["BCRYPT_ROUNDS"] = "4"
+    os.environ["WARM_UP_ON_START"] = "0"
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    os.environ["SESSION_SWEEP_INTERVAL"] = "0"
+    os.environ["EMAIL_OUTBOX_INTERVAL"] = "0"
+    os.environ["MAINTENANCE_INTERVAL"] = "0"
+
+    import llm
+    import app as app_module
+
+    app_module.AUTH._send_email = lambda *args, **kwargs: None
+    FakeModel.latency = llm_latency
+    llm.get_model = lambda name=llm.MODEL_NAME: FakeModel(name)
+    flask_app = app_module.create_app()
+    flask_app.config["TESTING"] = True
+    return app_module, flask_app
+
+
+def seed(app_module, num_users: int, num_letters: int, rng: random.Random) -> list:
+    """ Inserts verified users (plus the admin) and letters, returns the user emails """
+    from db import rebuild_stats
+    from user import User, Letter
+
+    hashed_password = app_module.AUTH._hash_password(BENCH_PASSWORD)
+    session = app_module.dbs._create_session()
+    try:
+        users = [User(email=f"teacher{i}@bench.local", hashed_password=hashed_password, first_name=f"First{i}",
+                      last_name=f"Last{i}", phone_number="0240000000", gender="F", is_verified=1)
+                 for i in range(num_users)]
+        users.append(User(email=ADMIN_EMAIL, hashed_password=hashed_password, first_name="Admin",
+                          last_name="Admin", phone_number="0240000000", gender="M", is_verified=1, is_admin=True))
+        session.add_all(users)
+        session.flush()
+        letter_types = list(LETTER_PAYLOADS)
+        session.add_all([
+            Letter(user_id=owner.id, user_first_name=owner.first_name, user_last_name=owner.last_name,
+                   type=letter_type, content=json.dumps({"NAME": owner.first_name.upper()}),
+                   filename=f"{letter_type} for {owner.first_name}.docx")
+            for owner, letter_type in ((rng.choice(users[:-1]), rng.choice(letter_types))
+                                       for _ in range(num_letters))
+        ])
+        # Rows inserted directly skip the dashboard counters, so count them once here,
+        # after flushing the letters so the raw queries on the connection see them
+        session.flush()
+        rebuild_stats(session.connection())
+        session.commit()
+        return [user.email for user in users[:-1]]
+    finally:
+        session.close()
+
+
+def letter_payload(letter_type: str, index: int) -> dict:
+    payload = {
+        "letter_type": letter_type, "name": f"Teacher {index}", "staffid": "12345", "phone": "0240000000",
+        "registeredno": "987654", "school": "Example School", "address": "P.O. Box 1", "district_town": "Ho",
+        "address_town": "Ho", "district": "Ho Municipal", "date_on_letter": "2023-07-11"
+    }
+    payload.update(LETTER_PAYLOADS[letter_type])
+    return payload
+
+
+def timed(recorder: Recorder, label: str, call, expected=(200,)):
+    started = time.perf_counter()
+    response = call()
+    finished = time.perf_counter()
+    recorder.record(label, started, finished, response.status_code in expected)
+    return response
+
+
+def stream_exam(recorder: Recorder, client) -> None:
+    """ Records time to first byte and total time of the streaming exam endpoint """
+    started = time.perf_counter()
+    response = client.post("/generate_examination_questions/stream", json=EXAM_PAYLOAD, buffered=False)
+    chunks = iter(response.response)
+    next(chunks, None)
+    first_byte = time.perf_counter()
+    lines = b"".join(chunks).splitlines()
+    finished = time.perf_counter()
+    response.close()
+    ok = response.status_code == 200 and bool(lines) and json.loads(lines[-1]).get("event") == "done"
+    recorder.record("POST /generate_examination_questions/stream (first byte)", started, first_byte, ok)
+    recorder.record("POST /generate_examination_questions/stream", started, finished, ok)
+
+
+def summarize_generation(stats: list) -> dict:
+    """ Mean LLM calls, tokens and in-handler latency per exam generation """
+    keys = ("llm_calls", "prompt_tokens", "output_tokens", "latency_ms")
+    return {f"mean_{key}": round(sum(s.get(key, 0) for s in stats) / len(stats), 1) for key in keys} \
+        if stats else {}
+
+
+class StatementCounter:
+    """ Counts SQL statements sent through an engine while active """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def run_load(app_module, flask_app, emails: list, num_requests: int, concurrency: int, rng: random.Random,
+             include_exams: bool) -> dict:
+    """ Drives the request mix phase by phase; returns the per-endpoint report and the login and exam summaries """
+    recorder = Recorder()
+    summaries = {"login": {}, "exam_generation": {}}
+    # Each client gets its own account where possible, as separate teachers would
+    shuffled = rng.sample(emails, len(emails))
+    plan = [shuffled[i % len(shuffled)] for i in range(num_requests)]
+
+    def login_client(email):
+        client = flask_app.test_client()
+        timed(recorder, "POST /login", lambda: client.post("/login", json={"email": email,
+                                                                           "password": BENCH_PASSWORD}))
+        return client
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Login storm: every planned request starts with a fresh login
+        with StatementCounter(app_module.dbs._engine) as statements:
+            clients = list(pool.map(login_client, plan))
+        summaries["login"]["statements_per_login"] = round(statements.count / len(plan), 2)
+
+        # Profile reads and letter listings on the authenticated clients
+        list(pool.map(lambda c: timed(recorder, "GET /profile", lambda: c.get("/profile")), clients))
+        list(pool.map(lambda c: timed(recorder, "GET /user_letters", lambda: c.get("/user_letters")), clients))
+
+        # Letter generation followed by the download of each generated document
+        letter_types = [rng.choice(list(LETTER_PAYLOADS)) for _ in clients]
+
+        def generate(args):
+            index, client = args
+            response = timed(recorder, "POST /generate_letter",
+                             lambda: client.post("/generate_letter",
+                                                 json=letter_payload(letter_types[index], index)))
+            return client, response.get_json().get("download_url")
+
+        generated = list(pool.map(generate, enumerate(clients)))
+
+        def download(args):
+            client, url = args
+            if url:
+                timed(recorder, "GET /download_generated_letter", lambda: client.get(url))
+
+        list(pool.map(download, generated))
+
+        if include_exams:
+            exam_clients = clients[:max(1, len(clients) // 10)]
+            for mode in ("multi", "structured"):
+                payload = dict(EXAM_PAYLOAD, generation_mode=mode)
+                responses = pool.map(lambda c: timed(recorder, f"POST /generate_examination_questions [{mode}]",
+                                                     lambda: c.post("/generate_examination_questions",
+                                                                    json=payload)),
+                                     exam_clients)
+                summaries["exam_generation"][mode] = summarize_generation(
+                    [r.get_json().get("generation") or {} for r in responses])
+            list(pool.map(lambda c: stream_exam(recorder, c), exam_clients))
+
+    # Admin listings run serially, as a dashboard would
+    admin = flask_app.test_client()
+    timed(recorder, "POST /admin/login",
+          lambda: admin.post("/admin/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}))
+    for _ in range(max(1, num_requests // 50)):
+        timed(recorder, "GET /admin/users", lambda: admin.get("/admin/users"))
+        timed(recorder, "GET /admin/letters", lambda: admin.get("/admin/letters"))
+        timed(recorder, "GET /admin/stats", lambda: admin.get("/admin/stats"))
+
+    return recorder.report(), summaries
+
+
+def micro(func, iterations: int) -> dict:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started
+    return {"iterations": iterations, "us_per_op": round(elapsed / iterations * 1e6, 2)}
+
+
+def run_micro(app_module, emails: list, iterations: int) -> dict:
+    """ Times individual DB methods and the DOCX render path """
+    from docxtpl import DocxTemplate
+
+    dbs = app_module.dbs
+    user = dbs.find_user_by(email=emails[0])
+    letter = dbs.add_letter(user_id=user.id, type='maternity_leave_letter', content="{}", filename="bench.docx")
+    context = {"NAME": "TEACHER", "SCHOOLNAME": "Example School", "ADDRESS": "P.O. Box 1", "ADDRESSTOWN": "HO",
+               "TOWN": "HO", "STAFFID": "12345", "REGISTERNO": "987654", "PHONE": "(0240000000)",
+               "DATEONLETTER": "JULY 11, 2023", "DISTRICT": "HO MUNICIPAL"}
+
+    def render():
+        doc = DocxTemplate("letter_templates/maternity_leave_letter.docx")
+        doc.render(context)
+        doc.save(io.BytesIO())
+
+    return {
+        "DB.find_user_by": micro(lambda: dbs.find_user_by(email=emails[0]), iterations),
+        "DB.update_user": micro(lambda: dbs.update_user(user.id, phone_number="0240000000"),
+                                iterations),
+        "DB.add_letter": micro(lambda: dbs.add_letter(user_id=user.id, type='maternity_leave_letter',
+                                                      content="{}", filename="bench.docx"), iterations),
+        "DB.get_letter": micro(lambda: dbs.get_letter(letter.id), iterations),
+        "DB.get_letters_by_user": micro(lambda: dbs.get_letters_by_user(user.id), iterations),
+        "DB.get_all_letters": micro(dbs.get_all_letters, max(1, iterations // 10)),
+        "docx.render": micro(render, max(1, iterations // 10)),
+    }
+
+
+def run_writes(app_module, emails: list, num_ops: int, concurrency: int) -> dict:
+    """ Committed writes per second through the DB methods, from `concurrency` threads at once """
+    dbs = app_module.dbs
+    users = [dbs.find_user_by(email=email) for email in emails[:max(1, concurrency)]]
+    results = {"backend": dbs._engine.dialect.name, "concurrency": concurrency}
+
+    def throughput(label, op, ops=num_ops, rows_per_op=1):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(op, range(ops)))
+        elapsed = time.perf_counter() - started
+        results[label] = {"ops": ops, "rows_per_s": round(ops * rows_per_op / elapsed, 1)}
+
+    letter_ids = [None] * num_ops
+
+    def add_letter(i):
+        letter_ids[i] = dbs.add_letter(user_id=users[i % len(users)].id, type='maternity_leave_letter',
+                                       content=json.dumps({"NAME": f"TEACHER {i}"}), filename="bench.docx").id
+
+    batch = 500
+    hashed_password = app_module.AUTH._hash_password(BENCH_PASSWORD)
+
+    def add_users_bulk(i):
+        dbs.add_users_bulk([{"email": f"bulk{i}.{j}@bench.local", "hashed_password": hashed_password,
+                             "first_name": "Bulk", "last_name": f"User{j}", "phone_number": "0240000000",
+                             "gender": "F", "is_verified": 1} for j in range(batch)], [])
+
+    throughput("add_letter", add_letter)
+    throughput("update_user", lambda i: dbs.update_user(users[i % len(users)].id, phone_number=f"024{i:07d}"))
+    throughput("delete_letter", lambda i: dbs.delete_letter(letter_ids[i]))
+    throughput("add_users_bulk", add_users_bulk, ops=max(1, num_ops // 50), rows_per_op=batch)
+    return results
+
+
+def run_serialization(app_module, flask_app, emails: list, num_rows: int, repeats: int = 3) -> dict:
+    """
+    Time and peak allocation to build a `num_rows` letter listing, the old way (ORM objects
+    copied into dicts, jsonify) against column-projected rows encoded by json_response.
+    """
+    import tracemalloc
+    from flask import jsonify
+    from sqlalchemy import insert
+    from serializers import ADMIN_LETTER_FIELDS, json_response, orjson, rows_to_dicts
+    from user import Letter
+
+    dbs = app_module.dbs
+    user = dbs.find_user_by(email=emails[0])
+    existing = len(dbs.get_letter_rows(("id",)))
+    missing = num_rows - existing
+    if missing > 0:
+        session = dbs._create_session()
+        try:
+            session.execute(insert(Letter), [
+                {"user_id": user.id, "user_first_name": user.first_name, "user_last_name": user.last_name,
+                 "type": "maternity_leave_letter", "content": json.dumps({"NAME": f"TEACHER {i}"}),
+                 "filename": f"bench {i}.docx"} for i in range(missing)])
+            session.commit()
+        finally:
+            session.close()
+
+    def orm_jsonify():
+        return jsonify({"letters": [
+            {"id": letter.id, "user_id": letter.user_id, "user_first_name": letter.user_first_name,
+             "user_last_name": letter.user_last_name, "type": letter.type, "content": letter.content,
+             "generated_at": letter.generated_at}
+            for letter in dbs.get_all_letters()]})
+
+    def projected_rows():
+        letters = dbs.get_letter_rows(ADMIN_LETTER_FIELDS)
+        return json_response({"letters": rows_to_dicts(letters, ADMIN_LETTER_FIELDS)})
+
+    results = {"rows": max(num_rows, existing), "encoder": "orjson" if orjson else "json"}
+    with flask_app.app_context():
+        for name, build in (("orm_jsonify", orm_jsonify), ("projected_rows", projected_rows)):
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                response = build()
+                timings.append(time.perf_counter() - started)
+            tracemalloc.start()
+            build()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            timings.sort()
+            results[name] = {"median_ms": round(timings[len(timings) // 2] * 1000, 1),
+                             "peak_alloc_kb": round(peak / 1024), "response_kb": round(len(response.data) / 1024)}
+    return results
+
+
+def measure_startup(runs: int = 3) -> dict:
+    """ Median wall time of a cold `import wsgi` in fresh interpreters """
+    timings = []
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+                   API_KEY=os.getenv("API_KEY", "benchmark"), WARM_UP_ON_START="0")
+        code = "import time; started = time.perf_counter(); import wsgi; print(time.perf_counter() - started)"
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                    check=True).stdout
+            timings.append(float(output.strip().splitlines()[-1]))
+    timings.sort()
+    return {"runs": runs, "median_s": round(timings[len(timings) // 2], 4), "max_s": round(timings[-1], 4)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="number of seeded users")
+    parser.add_argument("--letters", type=int, default=500, help="number of seeded letters")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint in the load mix")
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads driving the load mix")
+    parser.add_argument("--iterations", type=int, default=200, help="iterations per micro-benchmark")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the fake Gemini model sleeps")
+    parser.add_argument("--db-url", help="benchmark this database instead of a temp SQLite file, e.g. "
+                        "postgresql://localhost/bench (its tables are dropped first)")
+    parser.add_argument("--writes", type=int, default=200, help="operations per write-throughput test (0 skips)")
+    parser.add_argument("--auth-mode", choices=["db", "stateless"], default="db",
+                        help="database sessions or signed session tokens")
+    parser.add_argument("--skip-exams", action="store_true", help="leave exam generation out of the mix")
+    parser.add_argument("--serialization-rows", type=int, default=10000,
+                        help="letters in the serialization benchmark (0 skips it)")
+    parser.add_argument("--seed", type=int, default=1234, help="random seed for a reproducible mix")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--startup-budget", type=float,
+                        help="only time a cold import of the app; exit 1 if the median exceeds this many seconds")
+    args = parser.parse_args(argv)
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    rng = random.Random(args.seed)
+
+    if args.startup_budget is not None:
+        startup = measure_startup()
+        startup["budget_s"] = args.startup_budget
+        print(json.dumps({"startup": startup}, indent=2))
+        return 0 if startup["median_s"] <= args.startup_budget else 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app_module, flask_app = boot(workdir, args.llm_latency, args.auth_mode, args.db_url)
+        emails = seed(app_module, args.users, args.letters, rng)
+        endpoints, summaries = run_load(app_module, flask_app, emails, args.requests, args.concurrency, rng,
+                                        not args.skip_exams)
+        report = {
+            "config": vars(args),
+            "python": sys.version.split()[0],
+            "endpoints": endpoints,
+            **summaries,
+            "micro": run_micro(app_module, emails, args.iterations),
+        }
+        if args.writes:
+            report["writes"] = run_writes(app_module, emails, args.writes, args.concurrency)
+        if args.serialization_rows:
+            report["serialization"] = run_serialization(app_module, flask_app, emails, args.serialization_rows)
+        app_module.dbs._engine.dispose()
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+
+class MemoryCache:
+    """ Keys held in this process; only the worker that wrote a key sees it """
+
+    shared = False
+
+    def __init__(self, max_keys: int = 100000):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    def _live(self, key: str, now: float):
+        item = self._items.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._items[key]
+            return None
+        return item
+
+    def _store(self, key: str, value: str, expires_at, now: float) -> None:
+        if len(self._items) >= self._max_keys and key not in self._items:
+            self._items = {k: v for k, v in self._items.items() if v[1] is None or v[1] > now}
+        self._items[key] = (value, expires_at)
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._live(key, time.time())
+        return item[0] if item else None
+
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._store(key, str(value), now + ttl if ttl else None, now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        """ Adds `amount` and returns the new value; `ttl` only applies when the key is created """
+        now = time.time()
+        with self._lock:
+            item = self._live(key, now)
+            if item is None:
+                value, expires_at = amount, now + ttl if ttl else None
+            else:
+                value, expires_at = int(item[0]) + amount, item[1]
+            self._store(key, str(value), expires_at, now)
+        return value
+
+
+class SQLiteCache:
+    """ Keys in a SQLite file shared by every worker on the host """
+
+    shared = True
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        self._connect().execute("CREATE TABLE IF NOT EXISTS cache "
+                                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _purge(self, conn: sqlite3.Connection, now: float) -> None:
+        # Expired keys are skipped on read; delete them now and then so the file does not grow
+        if random.random() < 0.001:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+
+    def get(self, key: str):
+        row = self._connect().execute("SELECT value FROM cache WHERE key = ? "
+                                      "AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, str(value), now + ttl if ttl else None))
+        self._purge(conn, now)
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        now = time.time()
+        conn = self._connect()
+        # One upsert, so concurrent increments from other workers are never lost
+        row = conn.execute(
+            "INSERT INTO cache (key, value, expires_at) VALUES (?1, ?2, ?3) ON CONFLICT (key) DO UPDATE SET "
+            "value = CASE WHEN expires_at <= ?4 THEN ?2 ELSE CAST(value AS INTEGER) + ?2 END, "
+            "expires_at = CASE WHEN expires_at <= ?4 THEN ?3 ELSE expires_at END RETURNING value",
+            (key, amount, now + ttl if ttl else None, now)).fetchone()
+        self._purge(conn, now)
+        return int(row[0])
+
+
+class RedisCache:
+    """ Keys in Redis (or any server speaking its protocol), shared by every node """
+
+    shared = True
+
+    def __init__(self, url: str = None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+
+    def get(self, key: str):
+        value = self._client.get(key)
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        self._client.set(key, str(value), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(key)
+
+    def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        # One MULTI block: a missing key is created at 0 with its expiry, then incremented, so a
+        # key never exists without its TTL and concurrent increments are never lost
+        pipe = self._client.pipeline(transaction=True)
+        if ttl:
+            pipe.set(key, 0, px=int(ttl * 1000), nx=True)
+        pipe.incrby(key, amount)
+        return int(pipe.execute()[-1])
+
+
+def create_cache(url: str = None):
+    """ The cache named by `url` (default CACHE_URL): memory://, sqlite:///path/to/file or redis://host:port/db """
+    url = url or os.getenv("CACHE_URL", "memory://")
+    scheme, _, rest = url.partition("://")
+    if scheme == "memory":
+        return MemoryCache()
+    if scheme == "sqlite":
+        return SQLiteCache(rest[1:] if rest.startswith("/") else rest)
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisCache(url)
+    raise ValueError(f"Unsupported CACHE_URL '{url}'")
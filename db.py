@@ -1,34 +1,286 @@
+import json
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
 from typing import Type
+from uuid import uuid4
 
-from sqlalchemy import create_engine
+from sqlalchemy import DateTime, String, create_engine, delete, event, func, insert, inspect, make_url, or_, select, \
+    text, update
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import NoResultFound
-from user import User, Base, Letter
+from sqlalchemy.exc import IntegrityError, NoResultFound
+from snapshot import Snapshot
+from user import User, Base, Letter, DownloadToken, UserSession, RevokedToken, OutboxEmail, StatCounter, IdempotencyKey
+
+# Statements (or callables taking the connection) that upgrade an existing
+# database to each schema version. Fresh databases are created directly at
+# SCHEMA_VERSION by create_all, which also adds any new tables after the
+# statements below have run.
+MIGRATIONS = {
+    2: [
+        "ALTER TABLE users ADD COLUMN updated_at DATETIME",
+        "UPDATE users SET updated_at = CURRENT_TIMESTAMP",
+        "ALTER TABLE letters ADD COLUMN updated_at DATETIME",
+        "UPDATE letters SET updated_at = generated_at",
+        "CREATE INDEX IF NOT EXISTS ix_letters_user_id ON letters (user_id)",
+    ],
+    # Sessions move to their own table (created by create_all); sessions held in users.session_id end
+    3: [
+        "UPDATE users SET session_id = NULL",
+    ],
+    # revoked_tokens for signed session tokens (created by create_all)
+    4: [],
+    # email_outbox for queued verification emails (created by create_all)
+    5: [],
+    # stats_counters for the admin dashboard, counted from the existing rows
+    6: [
+        "CREATE INDEX IF NOT EXISTS ix_users_last_login ON users (last_login)",
+        lambda conn: rebuild_stats(conn),
+    ],
+    # idempotency_keys for retried generation requests (created by create_all)
+    7: [],
+    # Rendered documents are stored per letter
+    8: [
+        lambda conn: _add_column(conn, "download_tokens", "letter_id", String(36)),
+    ],
+    # Outbox emails are claimed by one worker before sending
+    9: [
+        lambda conn: _add_column(conn, "email_outbox", "claimed_at", DateTime()),
+        lambda conn: _add_column(conn, "email_outbox", "claim_token", String(32)),
+    ],
+    # Databases created fresh since version 6 missed the last_login index, which the model now declares
+    10: [
+        "CREATE INDEX IF NOT EXISTS ix_users_last_login ON users (last_login)",
+    ],
+}
+SCHEMA_VERSION = max(MIGRATIONS, default=1)
+
+
+def database_url() -> str:
+    return os.getenv("DATABASE_URL", "sqlite:///users.db")
+
+
+def create_db_engine(url: str = None):
+    """
+    An engine for `url` (default DATABASE_URL). SQLite gets WAL mode; server databases such as
+    PostgreSQL get a pool of DB_POOL_SIZE connections per worker, plus DB_MAX_OVERFLOW more
+    under load, each checked with a ping before use so connections the server dropped are replaced.
+    """
+    url = make_url(url or database_url())
+    if url.get_backend_name() == "sqlite":
+        engine = create_engine(url)
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        return engine
+    if url.drivername == "postgresql":
+        # psycopg 3 is the driver in requirements.txt; SQLAlchemy would otherwise look for psycopg2
+        url = url.set(drivername="postgresql+psycopg")
+    return create_engine(url, pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+                         max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+                         pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                         pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")), pool_pre_ping=True)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers in other workers proceed while one worker writes, and
+    # busy_timeout makes concurrent writers wait instead of failing immediately.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def _add_column(conn, table: str, column: str, column_type) -> None:
+    """ Adds a column to a table from an earlier version; a missing table is created later, with it, by create_all """
+    if inspect(conn).has_table(table):
+        # Spelled by the dialect, e.g. DATETIME on SQLite but TIMESTAMP WITHOUT TIME ZONE on PostgreSQL
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type.compile(dialect=conn.dialect)}"))
+
+
+def migrate(engine) -> int:
+    """ Creates or upgrades the schema, returning the version it started from """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+        if version == SCHEMA_VERSION:
+            return version
+        if version is None:
+            # Databases created before versioning hold the version 1 tables
+            version = 1 if inspect(conn).has_table('users') else SCHEMA_VERSION
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            for statement in MIGRATIONS[target]:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(text(statement))
+        Base.metadata.create_all(conn)
+        conn.execute(text("DELETE FROM schema_version"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": SCHEMA_VERSION})
+    return version
+
+
+def letter_counters(letter_type: str, content: str, generated_at: datetime) -> list:
+    """ The (name, key) counters a letter contributes to """
+    try:
+        district = json.loads(content).get("DISTRICT")
+    except (TypeError, ValueError, AttributeError):
+        district = None
+    return [("letter_type", letter_type), ("letter_day", generated_at.date().isoformat()),
+            ("letter_district", district or "UNSPECIFIED")]
+
+
+def user_counters(is_verified) -> list:
+    return [("users", "total")] + ([("users", "verified")] if is_verified else [])
+
+
+def rebuild_stats(conn) -> None:
+    """ Recounts every dashboard counter from the users and letters tables """
+    StatCounter.__table__.create(conn, checkfirst=True)
+    counts = Counter()
+    for row in conn.execute(select(Letter.type, Letter.content, Letter.generated_at)
+                            .execution_options(yield_per=1000)):
+        counts.update(letter_counters(row.type, row.content, row.generated_at))
+    for row in conn.execute(select(User.is_verified, User.last_login)):
+        counts.update(user_counters(row.is_verified))
+        if row.last_login is not None:
+            counts[("active_day", row.last_login.date().isoformat())] += 1
+    conn.execute(delete(StatCounter))
+    if counts:
+        conn.execute(insert(StatCounter), [{"name": name, "key": key, "value": value}
+                                           for (name, key), value in counts.items()])
 
 
 class DB:
     def __init__(self):
-        self._engine = create_engine("sqlite:///users.db")
-        # Base.metadata.drop_all(self._engine)
-        Base.metadata.create_all(self._engine)
-        self._Session = sessionmaker(bind=self._engine)
+        self._engine = create_db_engine()
+        # Cheap version check when the schema was already migrated at deploy time
+        migrate(self._engine)
+        # Objects returned after commit keep the values written or returned by the INSERT instead of reloading them
+        self._Session = sessionmaker(bind=self._engine, expire_on_commit=False)
+        self.download_token_ttl = timedelta(minutes=int(os.getenv("DOWNLOAD_TOKEN_TTL_MINUTES", "30")))
+        # A read-only copy for admin reads; create_app starts its background refresh
+        self.snapshot = None
+        max_age = float(os.getenv("ADMIN_SNAPSHOT_MAX_AGE", "60"))
+        path = self._engine.url.database
+        if self._engine.dialect.name == "sqlite" and max_age > 0 and path and path != ":memory:":
+            self.snapshot = Snapshot(path, os.getenv("ADMIN_SNAPSHOT_PATH", f"{path}.snapshot"), max_age)
 
     def _create_session(self):
         return self._Session()
 
+    def _bump(self, session, added=(), removed=()) -> None:
+        """ Counts `added` (name, key) counters up and `removed` ones down, within the caller's transaction """
+        counts = Counter(added)
+        counts.subtract(removed)
+        counts = {counter: value for counter, value in counts.items() if value}
+        if not counts:
+            return
+        if self._engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        statement = upsert(StatCounter)
+        statement = statement.on_conflict_do_update(index_elements=[StatCounter.name, StatCounter.key],
+                                                    set_={"value": StatCounter.value + statement.excluded.value})
+        session.execute(statement, [{"name": name, "key": key, "value": value}
+                                    for (name, key), value in counts.items()])
+
+    def _read_session(self, snapshot: bool = False):
+        """ A session for reads that tolerate ADMIN_SNAPSHOT_MAX_AGE seconds of staleness when snapshot is set """
+        if snapshot and self.snapshot is not None:
+            return self.snapshot.session()
+        return self._create_session()
+
     def add_user(self, email: str, hashed_password: str, first_name: str, last_name: str, phone_number: str,
                  gender: str, verification_code: str) -> User:
         session = self._create_session()
         try:
-            new_user = User(email=email, hashed_password=hashed_password, first_name=first_name, last_name=last_name,
-                            phone_number=phone_number, gender=gender, verification_code=verification_code)
-            session.add(new_user)
+            new_user = session.scalars(insert(User).returning(User), [{
+                "email": email, "hashed_password": hashed_password, "first_name": first_name, "last_name": last_name,
+                "phone_number": phone_number, "gender": gender, "verification_code": verification_code}]).one()
+            self._bump(session, user_counters(new_user.is_verified))
             session.commit()
-            session.refresh(new_user)
         finally:
             session.close()
         return new_user
 
+    def get_existing_emails(self, emails, chunk_size: int = 500) -> set:
+        """ The subset of `emails` already registered, in one IN query per chunk """
+        emails = list(emails)
+        session = self._create_session()
+        try:
+            existing = set()
+            for start in range(0, len(emails), chunk_size):
+                existing.update(session.scalars(select(User.email)
+                                                .where(User.email.in_(emails[start:start + chunk_size]))))
+            return existing
+        finally:
+            session.close()
+
+    def add_users_bulk(self, users: list, emails: list) -> int:
+        """
+        Inserts `users` (column dicts) with one executemany and queues `emails` (to_email,
+        subject, body dicts) in the same transaction, so every imported user gets its email.
+        Returns the number of users inserted, or raises IntegrityError if an email is taken.
+        """
+        session = self._create_session()
+        try:
+            session.execute(insert(User), users)
+            self._bump(session, [counter for user in users for counter in user_counters(user.get("is_verified"))])
+            if emails:
+                session.execute(insert(OutboxEmail), emails)
+            session.commit()
+            return len(users)
+        except IntegrityError:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def claim_pending_emails(self, limit: int = 50, max_attempts: int = 5,
+                             stale_after: timedelta = timedelta(minutes=10)) -> list:
+        """
+        Claims up to `limit` unsent emails for this worker and returns them. The claim is a single
+        UPDATE, so each email goes to one worker; a claim older than `stale_after` belongs to a
+        worker that died while sending and is taken over.
+        """
+        now = datetime.utcnow()
+        token = uuid4().hex
+        claimable = (OutboxEmail.sent_at.is_(None),
+                     or_(OutboxEmail.claimed_at.is_(None), OutboxEmail.claimed_at < now - stale_after))
+        pending = select(OutboxEmail.id).where(*claimable, OutboxEmail.attempts < max_attempts) \
+            .order_by(OutboxEmail.id).limit(limit)
+        session = self._create_session()
+        try:
+            session.execute(update(OutboxEmail).where(OutboxEmail.id.in_(pending.scalar_subquery()), *claimable)
+                            .values(claimed_at=now, claim_token=token),
+                            execution_options={"synchronize_session": False})
+            session.commit()
+            return session.execute(select(OutboxEmail.id, OutboxEmail.to_email, OutboxEmail.subject, OutboxEmail.body)
+                                   .where(OutboxEmail.claim_token == token).order_by(OutboxEmail.id)).all()
+        finally:
+            session.close()
+
+    def mark_email_sent(self, email_id: int) -> None:
+        session = self._create_session()
+        try:
+            session.execute(update(OutboxEmail).where(OutboxEmail.id == email_id)
+                            .values(sent_at=datetime.utcnow(), attempts=OutboxEmail.attempts + 1))
+            session.commit()
+        finally:
+            session.close()
+
+    def mark_email_failed(self, email_id: int, error: str) -> None:
+        """ Records the error and releases the claim, so the next delivery round retries the email """
+        session = self._create_session()
+        try:
+            session.execute(update(OutboxEmail).where(OutboxEmail.id == email_id)
+                            .values(last_error=error, attempts=OutboxEmail.attempts + 1, claimed_at=None,
+                                    claim_token=None))
+            session.commit()
+        finally:
+            session.close()
+
     def find_user_by(self, **kwargs) -> Type[User]:
         session = self._create_session()
         try:
@@ -45,71 +297,235 @@ class DB:
             user = session.query(User).get(user_id)
             if user is None:
                 raise NoResultFound
+            before = user_counters(user.is_verified)
             for key, value in kwargs.items():
                 setattr(user, key, value)
+            self._bump(session, user_counters(user.is_verified), before)
             session.commit()
         finally:
             session.close()
 
-    def get_all_users(self) -> list:
+    def start_session(self, email: str, session_id: str, duration: timedelta, verify=None):
+        """
+        Opens a new session for `email` in one transaction: a single SELECT of the login
+        columns, the `verify(row)` check (e.g. the password), then the last_login update and
+        session insert, which only apply if the password hash has not changed in between.
+        With session_id None only last_login is written, for stateless tokens.
+        Returns the (id, hashed_password, is_verified, is_admin, last_login) row, or None if no session was opened.
+        """
         session = self._create_session()
         try:
-            users = session.query(User).all()
+            row = session.execute(select(User.id, User.hashed_password, User.is_verified, User.is_admin,
+                                         User.last_login).where(User.email == email)).first()
+            if row is None or (verify is not None and not verify(row)):
+                return None
+            now = datetime.utcnow()
+            result = session.execute(update(User)
+                                     .where(User.id == row.id, User.hashed_password == row.hashed_password)
+                                     .values(last_login=now))
+            if result.rowcount != 1:
+                session.rollback()
+                return None
+            if row.last_login is None or row.last_login.date() < now.date():
+                self._bump(session, [("active_day", now.date().isoformat())])
+            if session_id is not None:
+                session.add(UserSession(id=session_id, user_id=row.id, created_at=now, expires_at=now + duration))
+            session.commit()
+            return row
         finally:
             session.close()
-        return users
 
-    def get_user_by_id(self, user_id) -> dict:
+    def get_user_by_session(self, session_id: str, duration: timedelta):
+        """
+        Returns the user holding an unexpired session, with one primary key lookup. The
+        expiry slides forward once less than half of `duration` is left, so an active
+        session is written at most once per half period.
+        """
         session = self._create_session()
         try:
-            user = session.query(User).filter_by(id=user_id).first()
-            if user:
-                return {"id": user.id,
-                        "email": user.email,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "phone_number": user.phone_number,
-                        "gender": user.gender
-                        }
-            return None
+            row = session.execute(select(User, UserSession.expires_at)
+                                  .join(UserSession, UserSession.user_id == User.id)
+                                  .where(UserSession.id == session_id)).first()
+            if row is None:
+                return None
+            user, expires_at = row
+            now = datetime.utcnow()
+            if expires_at <= now:
+                return None
+            if expires_at - now < duration / 2:
+                # Detach first so the commit does not expire the loaded user
+                session.expunge(user)
+                session.execute(update(UserSession).where(UserSession.id == session_id)
+                                .values(expires_at=now + duration))
+                session.commit()
+            return user
         finally:
             session.close()
 
-    def get_user_by_last_name(self, last_name) -> dict:
+    def end_session(self, session_id: str) -> None:
         session = self._create_session()
         try:
-            user = session.query(User).filter_by(last_name=last_name).first()
-            if user:
-                return {
-                        "id": user.id,
-                        "email": user.email,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "phone_number": user.phone_number,
-                        "gender": user.gender
-                        }
-            return None
+            session.execute(delete(UserSession).where(UserSession.id == session_id))
+            session.commit()
+        finally:
+            session.close()
+
+    def end_user_sessions(self, user_id: int) -> None:
+        session = self._create_session()
+        try:
+            session.execute(delete(UserSession).where(UserSession.user_id == user_id))
+            session.commit()
+        finally:
+            session.close()
+
+    def get_logged_in_user_ids(self, snapshot: bool = False) -> set:
+        session = self._read_session(snapshot)
+        try:
+            return set(session.scalars(select(UserSession.user_id).distinct()
+                                       .where(UserSession.expires_at > datetime.utcnow())))
+        finally:
+            session.close()
+
+    def count_logged_in_users(self) -> int:
+        session = self._create_session()
+        try:
+            return session.scalar(select(func.count(UserSession.user_id.distinct()))
+                                  .where(UserSession.expires_at > datetime.utcnow()))
+        finally:
+            session.close()
+
+    def count_users_logged_in_since(self, cutoff: datetime) -> int:
+        session = self._create_session()
+        try:
+            return session.scalar(select(func.count()).select_from(User).where(User.last_login > cutoff))
+        finally:
+            session.close()
+
+    def get_users_logged_in_since(self, cutoff: datetime, snapshot: bool = False) -> set:
+        session = self._read_session(snapshot)
+        try:
+            return set(session.scalars(select(User.id).where(User.last_login > cutoff)))
+        finally:
+            session.close()
+
+    def get_stat_counters(self, since: str) -> dict:
+        """ Every non-zero counter as {name: {key: value}}; per-day counters only from `since` (YYYY-MM-DD) on """
+        session = self._create_session()
+        try:
+            rows = session.execute(select(StatCounter.name, StatCounter.key, StatCounter.value)
+                                   .where(StatCounter.value != 0,
+                                          ~StatCounter.name.endswith("_day") | (StatCounter.key >= since))
+                                   .order_by(StatCounter.name, StatCounter.key))
+            stats = {}
+            for name, key, value in rows:
+                stats.setdefault(name, {})[key] = value
+            return stats
+        finally:
+            session.close()
+
+    def delete_expired_sessions(self, batch_size: int = 500) -> int:
+        """ Deletes expired sessions in batches so no single transaction holds the write lock for long """
+        deleted = 0
+        while True:
+            session = self._create_session()
+            try:
+                expired = select(UserSession.id).where(UserSession.expires_at <= datetime.utcnow()) \
+                    .limit(batch_size).scalar_subquery()
+                count = session.execute(delete(UserSession).where(UserSession.id.in_(expired))).rowcount
+                session.commit()
+            finally:
+                session.close()
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    def add_revocation(self, key: str, user_id, expires_at: datetime, revoked_at: datetime = None) -> None:
+        session = self._create_session()
+        try:
+            session.merge(RevokedToken(id=key, user_id=user_id, expires_at=expires_at,
+                                       revoked_at=revoked_at or datetime.utcnow()))
+            session.commit()
+        finally:
+            session.close()
+
+    def get_revocations(self) -> list:
+        """ (id, user_id, revoked_at) of every revocation still in force """
+        session = self._create_session()
+        try:
+            return session.execute(select(RevokedToken.id, RevokedToken.user_id, RevokedToken.revoked_at)
+                                   .where(RevokedToken.expires_at > datetime.utcnow())).all()
+        finally:
+            session.close()
+
+    def delete_expired_revocations(self) -> int:
+        session = self._create_session()
+        try:
+            count = session.execute(delete(RevokedToken)
+                                    .where(RevokedToken.expires_at <= datetime.utcnow())).rowcount
+            session.commit()
+            return count
+        finally:
+            session.close()
+
+    def get_all_users(self, snapshot: bool = False) -> list:
+        session = self._read_session(snapshot)
+        try:
+            users = session.query(User).all()
+        finally:
+            session.close()
+        return users
+
+    def get_user_by_id(self, user_id, snapshot: bool = False) -> dict:
+        return self._get_profile(User.id == user_id, snapshot)
+
+    def get_user_by_last_name(self, last_name, snapshot: bool = False) -> dict:
+        return self._get_profile(User.last_name == last_name, snapshot)
+
+    def _get_profile(self, condition, snapshot: bool) -> dict:
+        session = self._read_session(snapshot)
+        try:
+            row = session.execute(select(User.id, User.email, User.first_name, User.last_name, User.phone_number,
+                                         User.gender).where(condition).limit(1)).first()
+            return row._asdict() if row else None
+        finally:
+            session.close()
+
+    def get_user_rows(self, fields: tuple, snapshot: bool = False) -> list:
+        """ Only the `fields` columns of every user, as plain rows rather than ORM objects """
+        session = self._read_session(snapshot)
+        try:
+            return session.execute(select(*(getattr(User, field) for field in fields)).order_by(User.id)).all()
+        finally:
+            session.close()
+
+    def get_letter_rows(self, fields: tuple, user_id=None, snapshot: bool = False) -> list:
+        """ Only the `fields` columns of every letter, or of one user's letters, as plain rows """
+        session = self._read_session(snapshot)
+        try:
+            query = select(*(getattr(Letter, field) for field in fields))
+            if user_id is not None:
+                query = query.where(Letter.user_id == user_id)
+            return session.execute(query).all()
         finally:
             session.close()
 
     def add_letter(self, user_id, type, content, filename):
         session = self._create_session()
         try:
-            user = session.query(User).get(user_id)
+            user = session.execute(select(User.first_name, User.last_name).where(User.id == user_id)).first()
             if not user:
                 raise ValueError("User not found")
 
-            new_letter = Letter(
-                user_id=user.id,
-                user_first_name=user.first_name,
-                user_last_name=user.last_name,
-                type=type,
-                content=content,
-                filename=filename
-            )
-            session.add(new_letter)
-            session.commit()
-            session.refresh(new_letter)
+            new_letter = session.scalars(insert(Letter).returning(Letter), [{
+                "user_id": user_id,
+                "user_first_name": user.first_name,
+                "user_last_name": user.last_name,
+                "type": type,
+                "content": content,
+                "filename": filename,
+            }]).one()
+            self._bump(session, letter_counters(new_letter.type, new_letter.content, new_letter.generated_at))
+            session.commit()
             return new_letter
         finally:
             session.close()
@@ -124,8 +540,17 @@ class DB:
         finally:
             session.close()
 
-    def get_letters_by_user(self, user_id):
+    def get_letters_version(self, user_id) -> tuple:
+        """ Returns (count, latest updated_at) of a user's letters, which changes whenever the list does """
         session = self._create_session()
+        try:
+            return tuple(session.query(func.count(Letter.id), func.max(Letter.updated_at))
+                         .filter(Letter.user_id == user_id).one())
+        finally:
+            session.close()
+
+    def get_letters_by_user(self, user_id, snapshot: bool = False):
+        session = self._read_session(snapshot)
         try:
             return session.query(Letter).filter_by(user_id=user_id).all()
         finally:
@@ -137,8 +562,10 @@ class DB:
             letter = session.query(Letter).get(letter_id)
             if letter is None:
                 raise NoResultFound
+            before = letter_counters(letter.type, letter.content, letter.generated_at)
             for key, value in kwargs.items():
                 setattr(letter, key, value)
+            self._bump(session, letter_counters(letter.type, letter.content, letter.generated_at), before)
             session.commit()
         finally:
             session.close()
@@ -150,29 +577,191 @@ class DB:
             if letter is None:
                 raise NoResultFound
             session.delete(letter)
+            self._bump(session, removed=letter_counters(letter.type, letter.content, letter.generated_at))
             session.commit()
         finally:
             session.close()
 
-    def get_all_letters(self):
-        session = self._create_session()
+    def get_all_letters(self, snapshot: bool = False):
+        session = self._read_session(snapshot)
         try:
             return session.query(Letter).all()
         finally:
             session.close()
 
-    def get_letters_by_user_by_id(self, user_id):
-        session = self._create_session()
+    def get_letters_by_user_by_id(self, user_id, snapshot: bool = False):
+        session = self._read_session(snapshot)
         try:
             user = session.query(User).filter_by(id=user_id).first()
             return user
         finally:
             session.close()
 
-    def get_letters_by_user_by_last_name(self, last_name):
-        session = self._create_session()
+    def get_letters_by_user_by_last_name(self, last_name, snapshot: bool = False):
+        session = self._read_session(snapshot)
         try:
             user = session.query(User).filter_by(last_name=last_name).first()
             return user
         finally:
             session.close()
+
+    def add_download_token(self, template_name: str, context: dict, letter_id: str = None) -> str:
+        """ Stores a render context under a download token shared by all workers """
+        session = self._create_session()
+        try:
+            session.query(DownloadToken).filter(
+                DownloadToken.created_at < datetime.utcnow() - self.download_token_ttl).delete()
+            token = DownloadToken(template_name=template_name, context=json.dumps(context), letter_id=letter_id)
+            session.add(token)
+            session.commit()
+            return token.id
+        finally:
+            session.close()
+
+    def get_download_token(self, file_id: str, template_name: str):
+        """ Returns the (context, letter_id) stored under a download token, or None if missing or expired """
+        session = self._create_session()
+        try:
+            token = session.query(DownloadToken).filter(
+                DownloadToken.id == file_id, DownloadToken.template_name == template_name,
+                DownloadToken.created_at >= datetime.utcnow() - self.download_token_ttl).first()
+            return (json.loads(token.context), token.letter_id) if token else None
+        finally:
+            session.close()
+
+    def claim_idempotency_key(self, key_id: str, request_hash: str, ttl: timedelta, stale_after: timedelta):
+        """
+        Records a request as in flight under `key_id`. Returns None when the caller now owns the
+        key, otherwise the stored row. An in-flight row older than `stale_after` was left by a
+        worker that died, so the caller takes it over.
+        """
+        now = datetime.utcnow()
+        session = self._create_session()
+        try:
+            session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now))
+            session.add(IdempotencyKey(id=key_id, request_hash=request_hash, created_at=now, expires_at=now + ttl))
+            try:
+                session.commit()
+                return None
+            except IntegrityError:
+                session.rollback()
+            row = session.execute(select(IdempotencyKey.request_hash, IdempotencyKey.status_code,
+                                         IdempotencyKey.mimetype, IdempotencyKey.body, IdempotencyKey.created_at)
+                                  .where(IdempotencyKey.id == key_id)).first()
+            if row is None or row.status_code is not None or row.created_at >= now - stale_after:
+                return row
+            # Only one of several waiters can move created_at on from the value it read
+            taken = session.execute(update(IdempotencyKey)
+                                    .where(IdempotencyKey.id == key_id, IdempotencyKey.created_at == row.created_at)
+                                    .values(request_hash=request_hash, created_at=now, expires_at=now + ttl))
+            session.commit()
+            return None if taken.rowcount else row
+        finally:
+            session.close()
+
+    def complete_idempotency_key(self, key_id: str, status_code: int, mimetype: str, body: str) -> None:
+        session = self._create_session()
+        try:
+            session.execute(update(IdempotencyKey).where(IdempotencyKey.id == key_id)
+                            .values(status_code=status_code, mimetype=mimetype, body=body))
+            session.commit()
+        finally:
+            session.close()
+
+    def release_idempotency_key(self, key_id: str) -> None:
+        """ Forgets an in-flight key whose request failed, so a retry runs it again """
+        session = self._create_session()
+        try:
+            session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == key_id,
+                                                         IdempotencyKey.status_code.is_(None)))
+            session.commit()
+        finally:
+            session.close()
+
+    def get_live_download_keys(self) -> set:
+        """ The ids, and letter ids, of unexpired download tokens """
+        session = self._create_session()
+        try:
+            rows = session.execute(select(DownloadToken.id, DownloadToken.letter_id).where(
+                DownloadToken.created_at >= datetime.utcnow() - self.download_token_ttl))
+            return {key for row in rows for key in row if key}
+        finally:
+            session.close()
+
+    def get_letters_generated_before(self, cutoff: datetime, limit: int) -> list:
+        """ The oldest letters generated before `cutoff`, as rows of every letter column """
+        session = self._create_session()
+        try:
+            return session.execute(select(*Letter.__table__.columns).where(Letter.generated_at < cutoff)
+                                   .order_by(Letter.generated_at).limit(limit)).all()
+        finally:
+            session.close()
+
+    def count_letters_generated_before(self, cutoff: datetime) -> int:
+        session = self._create_session()
+        try:
+            return session.scalar(select(func.count()).select_from(Letter).where(Letter.generated_at < cutoff))
+        finally:
+            session.close()
+
+    def delete_letters(self, letter_ids: list) -> int:
+        session = self._create_session()
+        try:
+            deleted = session.execute(delete(Letter).where(Letter.id.in_(letter_ids))
+                                      .returning(Letter.type, Letter.content, Letter.generated_at)).all()
+            self._bump(session, removed=[counter for letter in deleted
+                                         for counter in letter_counters(*letter)])
+            session.commit()
+            return len(deleted)
+        finally:
+            session.close()
+
+    def table_row_counts(self) -> dict:
+        session = self._create_session()
+        try:
+            return {table.name: session.scalar(select(func.count()).select_from(table))
+                    for table in Base.metadata.sorted_tables}
+        finally:
+            session.close()
+
+    def storage_stats(self) -> dict:
+        """ Page counts of a SQLite database and the bytes its file and WAL use; empty for other databases """
+        if self._engine.dialect.name != "sqlite":
+            return {}
+        with self._engine.connect() as conn:
+            stats = {pragma: conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+                     for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum")}
+        path = self._engine.url.database
+        for suffix in ("", "-wal"):
+            stats[f"file{suffix.replace('-', '_')}_bytes"] = \
+                os.path.getsize(path + suffix) if path and os.path.exists(path + suffix) else 0
+        return stats
+
+    def vacuum(self, max_pages: int) -> None:
+        """
+        Returns up to `max_pages` free pages to the filesystem. The first run switches the
+        database to incremental auto-vacuum, which takes one full VACUUM.
+        """
+        with self._engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.exec_driver_sql("VACUUM")
+            else:
+                conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(max_pages)})")
+            # Copy the freed pages back from the WAL and truncate it, so the files actually shrink
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def analyze(self) -> None:
+        with self._engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+
+if __name__ == "__main__":
+    # python db.py migrate
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit("usage: python db.py migrate")
+    from dotenv import load_dotenv
+    load_dotenv()
+    engine = create_db_engine()
+    previous = migrate(engine)
+    print(f"Schema at version {SCHEMA_VERSION} (was {previous})")
@@ -0,0 +1,209 @@
+import json
+import random
+import re
+import string
+
+# One response holding both sections and their marking scheme, so the model never
+# has to be re-sent the questions to produce the answers.
+EXAM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "multiple_choice": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string"},
+                    "options": {"type": "array", "items": {"type": "string"}},
+                    "answer": {"type": "string", "description": "Letter of the correct option, e.g. B"},
+                },
+                "required": ["question", "options", "answer"],
+            },
+        },
+        "subjective": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string"},
+                    "answer": {"type": "string"},
+                },
+                "required": ["question", "answer"],
+            },
+        },
+    },
+    "required": ["multiple_choice", "subjective"],
+}
+
+STRUCTURED_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": EXAM_SCHEMA,
+}
+
+
+def structured_prompt(data: dict) -> str:
+    return (
+        f"Generate an examination on {data['subject'].upper()} for {data['class'].upper()} learners in the Ghana "
+        f"curriculum covering these topics: {data['topics_taught']}. "
+        f"Include exactly {data['num_of_mul_choice_ques']} standard multiple choice questions, each with four "
+        f"options and the letter of the correct option, and exactly {data['num_of_subjective_ques']} subjective "
+        f"questions, each with its answer. Do not number the questions or letter the options, do not bold "
+        f"anything and do not separate the questions under topics."
+    )
+
+
+def _text(value) -> str:
+    """ A stripped string field of a structured response, or '' when the model returned another type """
+    return value.strip() if isinstance(value, str) else ""
+
+
+def parse_structured(text: str, data: dict) -> dict:
+    """
+    Validates a structured response and formats it into the MUL_CHOICE_QUES,
+    MARKING_SCHEME_SEC_A, SUBJECTIVE_QUESTIONS and MARKING_SCHEME_SEC_B texts.
+    Raises ValueError when the response does not match what was asked for.
+    """
+    try:
+        exam = json.loads(text)
+        if not isinstance(exam, dict):
+            raise TypeError("expected a JSON object")
+        mul_choice = exam["multiple_choice"]
+        subjective = exam["subjective"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Malformed structured response: {e}")
+    if not isinstance(mul_choice, list) or not isinstance(subjective, list):
+        raise ValueError("Malformed structured response: question sets must be lists")
+
+    if len(mul_choice) != int(data['num_of_mul_choice_ques']) or \
+            len(subjective) != int(data['num_of_subjective_ques']):
+        raise ValueError("Structured response has the wrong number of questions")
+
+    questions = []
+    for number, item in enumerate(mul_choice, start=1):
+        item = item if isinstance(item, dict) else {}
+        options = item.get("options")
+        options = [_text(option) for option in options] if isinstance(options, list) else []
+        answer = _text(item.get("answer")).rstrip(".").upper()[:1]
+        letters = string.ascii_uppercase[:len(options)]
+        if not _text(item.get("question")) or len(options) < 2 or not all(options) or not answer \
+                or answer not in letters:
+            raise ValueError(f"Invalid multiple choice question {number}")
+        questions.append({"question": _text(item["question"]), "options": options, "answer": letters.index(answer)})
+    mul_choice_text, marking_scheme = format_multiple_choice(questions)
+
+    sub_questions, sub_answers = [], []
+    for number, item in enumerate(subjective, start=1):
+        item = item if isinstance(item, dict) else {}
+        question, answer = _text(item.get("question")), _text(item.get("answer"))
+        if not question or not answer:
+            raise ValueError(f"Invalid subjective question {number}")
+        sub_questions.append(f"{number}. {question}")
+        sub_answers.append(f"{number}. {answer}")
+
+    return {
+        "MUL_CHOICE_QUES": mul_choice_text,
+        "MARKING_SCHEME_SEC_A": marking_scheme,
+        "SUBJECTIVE_QUESTIONS": "\n\n".join(sub_questions),
+        "MARKING_SCHEME_SEC_B": "\n\n".join(sub_answers),
+    }
+
+
+def format_multiple_choice(questions: list) -> tuple[str, str]:
+    """ The MUL_CHOICE_QUES and MARKING_SCHEME_SEC_A texts for parsed questions, numbered in order """
+    blocks, answers = [], []
+    for number, item in enumerate(questions, start=1):
+        letters = string.ascii_uppercase[:len(item["options"])]
+        lines = [f"{number}. {item['question']}"]
+        lines += [f"   {letter}. {option}" for letter, option in zip(letters, item["options"])]
+        blocks.append("\n".join(lines))
+        answers.append(f"{number}. {letters[item['answer']]}")
+    return "\n\n".join(blocks), "\n".join(answers)
+
+
+_QUESTION_LINE = re.compile(r"^(\d+)\s*[.)]\s*(.*)$")
+_OPTION_LINE = re.compile(r"^\(?([A-Ha-h])\s*[.)]\s*(.*)$")
+_ANSWER_LINE = re.compile(r"^(\d+)\s*[.):-]?\s*(?:answer\s*[:-]?\s*)?\(?([A-Ha-h])\b", re.IGNORECASE)
+# Options that refer to the other options by position keep their place when shuffled
+_POSITIONAL_OPTION = re.compile(r"\b(all|none|both|neither) of the (above|options)\b|\b[A-H] and [A-H]\b",
+                                re.IGNORECASE)
+
+
+def parse_multiple_choice(questions_text: str, answers_text: str) -> list:
+    """
+    Parses stored MUL_CHOICE_QUES and MARKING_SCHEME_SEC_A texts, as produced by either
+    generation mode, into question, options and answer index dicts. Raises ValueError when
+    a question has fewer than two options or no answer among them.
+    """
+    questions = []
+    for raw in questions_text.splitlines():
+        line = raw.replace("*", "").strip()
+        if not line:
+            continue
+        question = _QUESTION_LINE.match(line)
+        option = _OPTION_LINE.match(line)
+        if option and questions:
+            questions[-1]["options"].append(option.group(2).strip())
+        elif question:
+            questions.append({"number": int(question.group(1)), "question": question.group(2).strip(),
+                              "options": []})
+        elif questions and questions[-1]["options"]:
+            questions[-1]["options"][-1] += f" {line}"
+        elif questions:
+            questions[-1]["question"] += f" {line}"
+
+    answers = {}
+    for raw in answers_text.splitlines():
+        answer = _ANSWER_LINE.match(raw.replace("*", "").strip())
+        if answer:
+            answers.setdefault(int(answer.group(1)), answer.group(2).upper())
+
+    if not questions:
+        raise ValueError("No multiple choice questions found")
+    for item in questions:
+        letters = string.ascii_uppercase[:len(item["options"])]
+        answer = answers.get(item.pop("number"))
+        if len(item["options"]) < 2 or answer is None or answer not in letters:
+            raise ValueError(f"Multiple choice question '{item['question'][:50]}' has no usable options or answer")
+        item["answer"] = letters.index(answer)
+    return questions
+
+
+def shuffle_multiple_choice(questions: list, seed: str) -> list:
+    """ The questions in an order, and with option orders, decided only by `seed`; answers follow their options """
+    rng = random.Random(seed)
+    shuffled = []
+    for item in rng.sample(questions, len(questions)):
+        order = list(range(len(item["options"])))
+        movable = [i for i in order if not _POSITIONAL_OPTION.search(item["options"][i])]
+        for i, j in zip(movable, rng.sample(movable, len(movable))):
+            order[i] = j
+        shuffled.append({"question": item["question"], "options": [item["options"][i] for i in order],
+                         "answer": order.index(item["answer"])})
+    return shuffled
+
+
+class GenerationStats:
+    """ Call count, token use and latency of one exam generation """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.latency_ms = 0.0
+
+    def add(self, response) -> None:
+        self.llm_calls += 1
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self.prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+            self.output_tokens += getattr(usage, "candidates_token_count", 0) or 0
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "latency_ms": round(self.latency_ms, 1),
+        }
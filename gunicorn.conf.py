@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for the Teachers Assistant API.
+
+Every value can be tuned through the environment without editing this file.
+Requests spend most of their time waiting on Gemini, SMTP and SQLite, so the
+default is a few processes with several threads each rather than many
+single-threaded workers.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Exam generation makes several sequential LLM calls
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth from DOCX rendering
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = 100
+
+# Each worker opens its own database connections after the fork
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """ Migrates the schema once in the master, before any worker starts """
+    load_dotenv()
+    from db import create_db_engine, migrate
+    engine = create_db_engine()
+    migrate(engine)
+    # Workers open their own pools; none of the master's connections may leak into them
+    engine.dispose()
@@ -0,0 +1,130 @@
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import time
+from datetime import timedelta
+
+from flask import Response, make_response, request
+
+from custom_error import CustomError
+
+HEADER = "Idempotency-Key"
+
+
+class IdempotencyConflict(CustomError):
+    """ Raised while another request with the same key is still running """
+
+    def __init__(self, message, retry_after: int, status_code=409):
+        super().__init__(message, status_code)
+        self.retry_after = retry_after
+
+
+class Idempotency:
+    """
+    Replays the stored response when a client retries a request with the same Idempotency-Key
+    header. Duplicates arriving while the first request runs wait for it to finish, through an
+    event in the same worker or by polling the database from other workers.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        # Stored responses hold download links, so a replay must not outlive the link's token
+        self.ttl = min(timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))), db.download_token_ttl)
+        self.wait_seconds = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+        self.poll_seconds = 0.25
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _begin(self, key_id: str, request_hash: str):
+        """ Claims the key and returns None, or returns the stored response of an earlier request """
+        # A claim older than the longest wait belongs to a request that will never finish it
+        stale_after = timedelta(seconds=self.wait_seconds * 2)
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            row = self._db.claim_idempotency_key(key_id, request_hash, self.ttl, stale_after)
+            with self._lock:
+                if row is None:
+                    self._inflight[key_id] = threading.Event()
+                    return None
+                # Missing when the owner runs in another worker, or has just finished
+                event = self._inflight.get(key_id)
+            if row.request_hash != request_hash:
+                raise CustomError("Idempotency-Key was already used with a different request", 422)
+            if row.status_code is not None:
+                response = Response(row.body, status=row.status_code, mimetype=row.mimetype)
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IdempotencyConflict("A request with this Idempotency-Key is still in progress",
+                                          int(self.poll_seconds * 4) or 1)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(self.poll_seconds, remaining))
+
+    def _finish(self, key_id: str, response) -> None:
+        """ Stores a successful response for replay, otherwise frees the key so a retry runs again """
+        try:
+            if response is not None and 200 <= response.status_code < 300 and not response.is_streamed:
+                self._db.complete_idempotency_key(key_id, response.status_code, response.mimetype,
+                                                  response.get_data(as_text=True))
+            else:
+                self._db.release_idempotency_key(key_id)
+        finally:
+            with self._lock:
+                event = self._inflight.pop(key_id, None)
+            if event is not None:
+                event.set()
+
+    def idempotent(self, endpoint: str = None):
+        """
+        Decorates a view so requests carrying an Idempotency-Key header run once per key and
+        session. A reused key with a different body is rejected with 422.
+        """
+        def decorator(view):
+            name = endpoint or view.__name__
+
+            def begin():
+                key = request.headers.get(HEADER)
+                if not key:
+                    return None, None
+                if len(key) > 255:
+                    raise CustomError("Idempotency-Key must be at most 255 characters", 400)
+                scope = request.cookies.get("session_id", "")
+                key_id = hashlib.sha256(f"{scope}\0{name}\0{key}".encode("utf-8")).hexdigest()
+                request_hash = hashlib.sha256(request.get_data()).hexdigest()
+                return key_id, self._begin(key_id, request_hash)
+
+            if inspect.iscoroutinefunction(view):
+                @functools.wraps(view)
+                async def wrapper(*args, **kwargs):
+                    key_id, replay = begin()
+                    if key_id is None:
+                        return await view(*args, **kwargs)
+                    if replay is not None:
+                        return replay
+                    response = None
+                    try:
+                        response = make_response(await view(*args, **kwargs))
+                        return response
+                    finally:
+                        self._finish(key_id, response)
+            else:
+                @functools.wraps(view)
+                def wrapper(*args, **kwargs):
+                    key_id, replay = begin()
+                    if key_id is None:
+                        return view(*args, **kwargs)
+                    if replay is not None:
+                        return replay
+                    response = None
+                    try:
+                        response = make_response(view(*args, **kwargs))
+                        return response
+                    finally:
+                        self._finish(key_id, response)
+            return wrapper
+        return decorator
@@ -0,0 +1,122 @@
+import csv
+import json
+import sys
+
+from sqlalchemy.exc import IntegrityError
+
+REQUIRED_FIELDS = ["email", "password", "first_name", "last_name", "phone_number", "gender"]
+
+# Errors beyond this many are counted but not listed in the report
+MAX_REPORTED_ERRORS = 100
+
+
+def read_teachers(stream, fmt: str):
+    """ Yields (line number, row dict) from a CSV file with a header row, or from JSON Lines """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for line_num, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {"_error": f"Invalid JSON: {e}"}
+            yield line_num, row if isinstance(row, dict) else {"_error": "Expected a JSON object"}
+    else:
+        raise ValueError(f"Unsupported import format '{fmt}', expected csv or jsonl")
+
+
+def format_for(filename: str, content_type: str = None) -> str:
+    if filename.endswith((".jsonl", ".ndjson")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "jsonl"
+    return "csv"
+
+
+def import_teachers(auth, db, rows, chunk_size: int = 500, workers: int = None):
+    """
+    Registers teachers in bulk and yields progress events as it goes. Rows whose email
+    is already registered, or repeated in the file, are skipped. Each chunk has its
+    passwords hashed in parallel and is inserted with one executemany, together with
+    its verification emails, which are queued in the outbox rather than sent inline.
+    """
+    rows = list(rows)
+    report = {"total": len(rows), "processed": 0, "imported": 0, "skipped": 0, "failed": 0, "errors": []}
+    yield {"event": "started", "total": report["total"]}
+
+    def reject(line_num, message):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_num, "message": message})
+
+    pending, seen = [], set()
+    for line_num, row in rows:
+        if "_error" in row:
+            reject(line_num, row["_error"])
+            continue
+        teacher = {field: str(row.get(field) or "").strip() for field in REQUIRED_FIELDS}
+        missing = [field for field in REQUIRED_FIELDS if not teacher[field]]
+        if missing:
+            reject(line_num, f"Missing {', '.join(missing)}")
+        elif teacher["email"] in seen:
+            report["skipped"] += 1
+        else:
+            seen.add(teacher["email"])
+            pending.append(teacher)
+    report["processed"] = report["failed"] + report["skipped"]
+
+    existing = db.get_existing_emails(seen)
+    report["skipped"] += len(existing)
+    report["processed"] += len(existing)
+    pending = [teacher for teacher in pending if teacher["email"] not in existing]
+    yield {"event": "progress", **_counts(report)}
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        hashes = auth.hash_passwords([teacher["password"] for teacher in chunk], workers)
+        users, emails = [], []
+        for teacher, hashed_password in zip(chunk, hashes):
+            code = auth.generate_verification_code()
+            users.append({"email": teacher["email"], "hashed_password": hashed_password,
+                          "first_name": teacher["first_name"], "last_name": teacher["last_name"],
+                          "phone_number": teacher["phone_number"], "gender": teacher["gender"],
+                          "verification_code": code})
+            emails.append(auth.verification_email(teacher["email"], teacher["first_name"], code))
+        try:
+            inserted = db.add_users_bulk(users, emails)
+        except IntegrityError:
+            # Someone registered one of these emails since the dedupe query; drop them and retry once
+            taken = db.get_existing_emails(user["email"] for user in users)
+            keep = [i for i, user in enumerate(users) if user["email"] not in taken]
+            inserted = db.add_users_bulk([users[i] for i in keep], [emails[i] for i in keep]) if keep else 0
+            report["skipped"] += len(users) - len(keep)
+        report["imported"] += inserted
+        report["processed"] += len(chunk)
+        yield {"event": "progress", **_counts(report)}
+
+    yield {"event": "done", **report}
+
+
+def _counts(report: dict) -> dict:
+    return {key: report[key] for key in ("total", "processed", "imported", "skipped", "failed")}
+
+
+if __name__ == "__main__":
+    # python importer.py teachers.csv [chunk_size]
+    if len(sys.argv) not in (2, 3):
+        sys.exit("usage: python importer.py <teachers.csv|teachers.jsonl> [chunk_size]")
+    from dotenv import load_dotenv
+    load_dotenv()
+    from auth import Auth
+    from db import DB
+
+    db = DB()
+    path = sys.argv[1]
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        events = import_teachers(Auth(db), db, read_teachers(f, format_for(path)),
+                                 chunk_size=int(sys.argv[2]) if len(sys.argv) == 3 else 500)
+        for event in events:
+            print(json.dumps(event), flush=True)
+    print("Queued verification emails are sent by the running app's outbox worker", file=sys.stderr)
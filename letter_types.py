@@ -0,0 +1,84 @@
+import json
+import os
+from datetime import datetime
+
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "letter_templates", "letter_types.json")
+
+MONTHS = ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December")
+
+
+def _format_date(value: str) -> str:
+    """ 2024-03-05 (or 2024-3-5) -> March 05, 2024 """
+    try:
+        parsed = datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD")
+    return f"{MONTHS[parsed.month - 1]} {parsed.day:02d}, {parsed.year}"
+
+
+# Transforms a context field can pipe its value through, e.g. "date_on_letter|date|upper"
+TRANSFORMS = {
+    "upper": lambda value: str(value).upper(),
+    "lower": lambda value: str(value).lower(),
+    "title": lambda value: str(value).title(),
+    "date": _format_date,
+    "parenthesize": lambda value: f"({value})",
+}
+
+
+class LetterType:
+    """ One letter: the request fields it requires and how they become its template context """
+
+    def __init__(self, name: str, template: str, title: str, context: dict):
+        self.name = name
+        self.template = template
+        self.title = title
+        self._fields = []
+        for key, spec in context.items():
+            source, *transforms = spec.split("|")
+            unknown = [transform for transform in transforms if transform not in TRANSFORMS]
+            if unknown:
+                raise ValueError(f"Letter type '{name}' uses unknown transform(s) {', '.join(unknown)}")
+            self._fields.append((key, source, tuple(TRANSFORMS[transform] for transform in transforms)))
+        self.required = tuple(dict.fromkeys(source for _, source, _ in self._fields))
+
+    def missing(self, data: dict) -> list:
+        return [key for key in self.required if key not in data]
+
+    def build_context(self, data: dict) -> dict:
+        """ Raises ValueError when a required field is missing or a value cannot be transformed """
+        if self.missing(data):
+            raise ValueError("Missing one or more required parameters")
+        context = {}
+        for key, source, transforms in self._fields:
+            value = data[source]
+            for transform in transforms:
+                value = transform(value)
+            context[key] = value
+        return context
+
+
+def load_registry(path: str = REGISTRY_PATH) -> dict:
+    """ Reads every letter type from `path`; each type may extend one of the shared context bases """
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    bases = spec.get("bases", {})
+    registry = {}
+    for name, letter in spec["letter_types"].items():
+        context = dict(bases[letter["extends"]]) if "extends" in letter else {}
+        context.update(letter.get("context", {}))
+        registry[name] = LetterType(name, os.path.join(os.path.dirname(path), letter.get("template", f"{name}.docx")),
+                                    letter.get("title", name.replace("_", " ").title()), context)
+    return registry
+
+
+LETTER_TYPES = load_registry()
+
+
+def template_path(template_name: str) -> str:
+    """ The .docx for a letter type, or for another template in letter_templates such as examination_questions """
+    letter_type = LETTER_TYPES.get(template_name)
+    if letter_type is not None:
+        return letter_type.template
+    return os.path.join(os.path.dirname(REGISTRY_PATH), f"{template_name}.docx")
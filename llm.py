@@ -0,0 +1,33 @@
+import os
+import threading
+
+MODEL_NAME = 'gemini-1.5-flash'
+
+_lock = threading.Lock()
+_genai = None
+_models = {}
+
+
+def _load_genai():
+    """ Imports and configures google.generativeai on first use; the import alone takes most of startup """
+    global _genai
+    if _genai is None:
+        with _lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.environ["API_KEY"])
+                _genai = genai
+    return _genai
+
+
+def get_model(name: str = MODEL_NAME):
+    """ Returns a shared GenerativeModel, creating the client on first call """
+    model = _models.get(name)
+    if model is None:
+        model = _models.setdefault(name, _load_genai().GenerativeModel(name))
+    return model
+
+
+def warm_up() -> None:
+    """ Loads the Gemini client ahead of the first generation request """
+    get_model()
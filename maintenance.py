@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_letters (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    user_first_name TEXT NOT NULL,
+    user_last_name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    generated_at TEXT NOT NULL,
+    updated_at TEXT,
+    archived_at TEXT NOT NULL,
+    content BLOB NOT NULL
+)
+"""
+
+
+class JobResult:
+    """ What one maintenance job did (or would do, in a dry run) and how fast """
+
+    def __init__(self, job: str, dry_run: bool):
+        self.job = job
+        self.dry_run = dry_run
+        self.items = 0
+        self.bytes = 0
+        self.details = {}
+        self._started = time.perf_counter()
+        self.duration_s = 0.0
+
+    def finish(self) -> "JobResult":
+        self.duration_s = time.perf_counter() - self._started
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "job": self.job,
+            "dry_run": self.dry_run,
+            "items": self.items,
+            "bytes": self.bytes,
+            "duration_s": round(self.duration_s, 3),
+            "items_per_s": round(self.items / self.duration_s, 1) if self.duration_s else None,
+            **self.details,
+        }
+
+
+def archive_letters(db, archive_path: str, older_than_days: int, batch_size: int = 500,
+                    dry_run: bool = False) -> JobResult:
+    """
+    Moves letters generated more than `older_than_days` ago into `archive_path`, a SQLite
+    file holding each letter's content zlib-compressed. Every batch is committed to the
+    archive before it is deleted from the main database, so an interrupted run loses nothing.
+    """
+    result = JobResult("archive_letters", dry_run)
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    result.details["cutoff"] = cutoff.isoformat()
+    if dry_run:
+        result.items = db.count_letters_generated_before(cutoff)
+        return result.finish()
+
+    archive = sqlite3.connect(archive_path)
+    try:
+        archive.execute(ARCHIVE_SCHEMA)
+        while True:
+            letters = db.get_letters_generated_before(cutoff, batch_size)
+            if not letters:
+                break
+            archived_at = datetime.utcnow().isoformat()
+            rows = []
+            for letter in letters:
+                content = zlib.compress(letter.content.encode("utf-8"))
+                result.bytes += len(letter.content)
+                rows.append((letter.id, letter.user_id, letter.user_first_name, letter.user_last_name, letter.type,
+                             letter.filename, letter.generated_at.isoformat(),
+                             letter.updated_at.isoformat() if letter.updated_at else None, archived_at, content))
+            with archive:
+                archive.executemany("INSERT OR REPLACE INTO archived_letters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    rows)
+            result.items += db.delete_letters([letter.id for letter in letters])
+    finally:
+        archive.close()
+    return result.finish()
+
+
+def purge_renders(db, render_dir: str, grace_seconds: int = 300, dry_run: bool = False) -> JobResult:
+    """
+    Deletes rendered documents no unexpired download token refers to (by token or letter id),
+    and temp and lock files left by renders that never finished. Files younger than
+    `grace_seconds` are left alone in case a render is still being written.
+    """
+    result = JobResult("purge_renders", dry_run)
+    if not os.path.isdir(render_dir):
+        return result.finish()
+    live = db.get_live_download_keys()
+    cutoff = time.time() - grace_seconds
+    for entry in os.scandir(render_dir):
+        # Documents are named '<letter id>.<digest>.docx', or '<token id>.docx' before letter ids were stored
+        if not entry.is_file() or (not entry.name.endswith(".lock") and entry.name.split(".", 1)[0] in live):
+            continue
+        stat = entry.stat()
+        if stat.st_mtime > cutoff:
+            continue
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        result.items += 1
+        result.bytes += stat.st_size
+    return result.finish()
+
+
+def compact(db, max_pages: int = 2000, dry_run: bool = False) -> JobResult:
+    """ Incrementally vacuums up to `max_pages` free pages, then refreshes planner statistics with ANALYZE """
+    result = JobResult("compact", dry_run)
+    before = db.storage_stats()
+    if before:
+        pages = min(before["freelist_count"], max_pages) if before["auto_vacuum"] == 2 else before["freelist_count"]
+        result.details["full_vacuum"] = before["auto_vacuum"] != 2
+        if not dry_run:
+            db.vacuum(max_pages)
+            after = db.storage_stats()
+            pages = before["page_count"] - after["page_count"]
+        result.items = pages
+        result.bytes = pages * before["page_size"]
+    if not dry_run:
+        db.analyze()
+    return result.finish()
+
+
+def _dir_size(path: str) -> tuple:
+    files = size = 0
+    if os.path.isdir(path):
+        for entry in os.scandir(path):
+            if entry.is_file():
+                files += 1
+                size += entry.stat().st_size
+    return files, size
+
+
+def report_sizes(db, archive_path: str, render_dir: str) -> JobResult:
+    """ Row counts per table and the bytes used by the database, the archive and rendered documents """
+    result = JobResult("report_sizes", False)
+    render_files, render_bytes = _dir_size(render_dir)
+    result.details.update({
+        "tables": db.table_row_counts(),
+        "database": db.storage_stats(),
+        "archive_bytes": os.path.getsize(archive_path) if os.path.exists(archive_path) else 0,
+        "render_files": render_files,
+        "render_bytes": render_bytes,
+    })
+    result.items = sum(result.details["tables"].values())
+    result.bytes = result.details["database"].get("file_bytes", 0) + result.details["archive_bytes"] + render_bytes
+    return result.finish()
+
+
+def in_window(window: str, hour: int) -> bool:
+    """ Whether `hour` (UTC) falls in a window such as '1-5', which may wrap past midnight like '22-4' """
+    start, _, end = window.partition("-")
+    start, end = int(start), int(end or start)
+    return start <= hour <= end if start <= end else hour >= start or hour <= end
+
+
+class Maintenance:
+    """ Runs the maintenance jobs with settings taken from the environment """
+
+    JOBS = ("archive_letters", "purge_renders", "compact", "report_sizes")
+
+    def __init__(self, db, render_dir: str):
+        self._db = db
+        self.render_dir = render_dir
+        self.archive_path = os.getenv('ARCHIVE_DATABASE_PATH', 'letters_archive.db')
+        self.archive_after_days = int(os.getenv('ARCHIVE_LETTERS_AFTER_DAYS', '0'))
+        self.compact_window = os.getenv('MAINTENANCE_WINDOW', '1-5')
+        self.vacuum_pages = int(os.getenv('MAINTENANCE_VACUUM_PAGES', '2000'))
+        self.dry_run = os.getenv('MAINTENANCE_DRY_RUN', '0') == '1'
+
+    def run(self, jobs=JOBS, dry_run: bool = None, off_peak_only: bool = False) -> list:
+        """ Runs `jobs` in order; with off_peak_only, compaction is skipped outside MAINTENANCE_WINDOW """
+        dry_run = self.dry_run if dry_run is None else dry_run
+        results = []
+        for job in jobs:
+            if job == "archive_letters":
+                if not self.archive_after_days:
+                    continue
+                result = archive_letters(self._db, self.archive_path, self.archive_after_days, dry_run=dry_run)
+            elif job == "purge_renders":
+                result = purge_renders(self._db, self.render_dir, dry_run=dry_run)
+            elif job == "compact":
+                if off_peak_only and not in_window(self.compact_window, datetime.utcnow().hour):
+                    continue
+                result = compact(self._db, self.vacuum_pages, dry_run=dry_run)
+            elif job == "report_sizes":
+                result = report_sizes(self._db, self.archive_path, self.render_dir)
+            else:
+                raise ValueError(f"Unknown maintenance job '{job}'")
+            logger.info("maintenance %s", json.dumps(result.to_dict(), default=str))
+            results.append(result.to_dict())
+        return results
+
+    def run_if_due(self, lock_path: str, interval: int) -> bool:
+        """
+        Runs unless another worker holds the lock or finished a run less than `interval` seconds
+        ago, as recorded in the lock file; returns whether it ran
+        """
+        with _try_lock(lock_path) as lock:
+            if lock is None or time.time() - lock.last_run() < interval:
+                return False
+            self.run(off_peak_only=True)
+            lock.record_run()
+        return True
+
+    def run_forever(self, interval: int) -> None:
+        """ Runs every `interval` seconds in one worker on the host, whichever wakes first after a run is due """
+        lock_path = os.getenv('MAINTENANCE_LOCK', os.path.join(tempfile.gettempdir(), 'teachers_assistant.maint.lock'))
+        while True:
+            time.sleep(interval)
+            try:
+                self.run_if_due(lock_path, interval)
+            except Exception:
+                logger.exception("Maintenance run failed")
+
+
+class _try_lock:
+    """
+    A non-blocking exclusive file lock, so only one worker on the host runs maintenance at a time.
+    The file holds the time the last run finished.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        import fcntl
+        self._file = open(self._path, "a+")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return self
+        except BlockingIOError:
+            return None
+
+    def __exit__(self, *exc) -> None:
+        self._file.close()
+
+    def last_run(self) -> float:
+        self._file.seek(0)
+        try:
+            return float(self._file.read().strip() or 0)
+        except ValueError:
+            return 0.0
+
+    def record_run(self) -> None:
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(time.time()))
+        self._file.flush()
+
+
+if __name__ == "__main__":
+    # python maintenance.py [--dry-run] [job ...]
+    args = sys.argv[1:]
+    dry_run = "--dry-run" in args
+    jobs = [arg for arg in args if arg != "--dry-run"] or Maintenance.JOBS
+    if any(job not in Maintenance.JOBS for job in jobs):
+        sys.exit(f"usage: python maintenance.py [--dry-run] [{' | '.join(Maintenance.JOBS)} ...]")
+    from dotenv import load_dotenv
+    load_dotenv()
+    from app import RENDER_DIR, dbs
+    print(json.dumps(Maintenance(dbs, RENDER_DIR).run(jobs, dry_run=dry_run), indent=2, default=str))
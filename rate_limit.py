@@ -0,0 +1,242 @@
+import functools
+import inspect
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import Response, request
+
+from custom_error import CustomError
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class TooManyRequests(CustomError):
+    """ Raised when a rate limit or concurrency cap rejects a request """
+
+    def __init__(self, message, retry_after: float, status_code=429):
+        super().__init__(message, status_code)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Limit:
+    """ A token bucket refilling `count` tokens every `period` seconds, parsed from e.g. '5/minute' """
+
+    def __init__(self, spec: str):
+        count, _, period = spec.partition("/")
+        self.spec = spec
+        self.capacity = float(count)
+        self.rate = self.capacity / PERIODS[period.strip()]
+
+
+class MemoryBackend:
+    """ Token buckets held in this process; limits apply per worker """
+
+    def __init__(self, max_keys: int = 100000):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        """ Takes `cost` tokens, returning 0 on success or the seconds until enough tokens are available """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + (now - updated) * limit.rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / limit.rate
+            if not wait:
+                tokens -= cost
+            if len(self._buckets) >= self._max_keys and key not in self._buckets:
+                self._prune(now)
+            self._buckets[key] = (tokens, now)
+        return wait
+
+    def refund(self, key: str, limit: Limit, cost: float = 1.0) -> None:
+        """ Returns tokens taken for a request that another bucket then rejected """
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.capacity, time.monotonic()))
+            self._buckets[key] = (min(limit.capacity, tokens + cost), updated)
+
+    def _prune(self, now: float) -> None:
+        # Buckets idle for an hour are full again under any limit we configure
+        self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < 3600}
+
+
+class SQLiteBackend:
+    """ Token buckets in a SQLite file shared by every worker on the host """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limits "
+                         "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tokens = limit.capacity if row is None else min(limit.capacity, row[0] + (now - row[1]) * limit.rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / limit.rate
+            if not wait:
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def refund(self, key: str, limit: Limit, cost: float = 1.0) -> None:
+        self._connect().execute("UPDATE rate_limits SET tokens = MIN(?, tokens + ?) WHERE key = ?",
+                                (limit.capacity, cost, key))
+
+
+class CacheBackend:
+    """
+    Fixed-window counters in a shared cache (see cache.py), so limits hold across every node.
+    Each window lasts the time a bucket takes to refill and admits its capacity.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def _window(self, key: str, limit: Limit, now: float) -> tuple:
+        period = limit.capacity / limit.rate
+        window = int(now // period)
+        return f"ratelimit:{key}:{window}", period, (window + 1) * period - now
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        window_key, period, remaining = self._window(key, limit, time.time())
+        used = self._cache.incr(window_key, math.ceil(cost), ttl=period + 1)
+        if used <= limit.capacity:
+            return 0.0
+        # A rejected request does not count against the window
+        self._cache.incr(window_key, -math.ceil(cost))
+        return remaining
+
+    def refund(self, key: str, limit: Limit, cost: float = 1.0) -> None:
+        self._cache.incr(self._window(key, limit, time.time())[0], -math.ceil(cost))
+
+
+def _client_ip() -> str:
+    # Behind a proxy this is the client's address only when TRUSTED_PROXIES enables ProxyFix (see app.create_app)
+    return request.remote_addr or "unknown"
+
+
+def _client_user(user_id=None) -> str:
+    """
+    The user a signed-in request's session belongs to, as resolved by `user_id`, so that logging
+    in again does not bring a fresh bucket. Otherwise the email the request is about.
+    """
+    session_id = request.cookies.get("session_id")
+    if session_id:
+        if user_id is None:
+            return f"session:{session_id}"
+        resolved = user_id(session_id)
+        if resolved is not None:
+            return f"user:{resolved}"
+    data = request.get_json(silent=True) or {}
+    email = data.get("email")
+    return f"email:{str(email).strip().lower()}" if email else f"ip:{_client_ip()}"
+
+
+SCOPES = {
+    "ip": _client_ip,
+    "user": _client_user,
+    "total": lambda: "*",
+}
+
+
+class RateLimiter:
+    def __init__(self, backend=None, cache=None, user_id=None):
+        """ `user_id` maps a session cookie to the id of its user, or None, for the 'user' scope """
+        self._user_id = user_id
+        self.enabled = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+        if backend is None:
+            kind = os.getenv("RATE_LIMIT_BACKEND", "memory")
+            if kind == "sqlite":
+                backend = SQLiteBackend(os.getenv("RATE_LIMIT_DB", "rate_limits.db"))
+            elif kind == "cache" and cache is not None:
+                backend = CacheBackend(cache)
+            else:
+                backend = MemoryBackend()
+        self.backend = backend
+        self._slots = {}
+
+    def _check(self, name: str, limits: dict) -> None:
+        """ Takes a token from every bucket, or from none of them when one rejects the request """
+        taken = []
+        for scope, limit in limits.items():
+            key = f"{name}:{scope}:{_client_user(self._user_id) if scope == 'user' else SCOPES[scope]()}"
+            wait = self.backend.take(key, limit)
+            if wait:
+                # A rejected request must not drain the other buckets, least of all the shared total
+                for taken_key, taken_limit in taken:
+                    self.backend.refund(taken_key, taken_limit)
+                raise TooManyRequests("Too many requests. Please try again later.", wait)
+            taken.append((key, limit))
+
+    def limit(self, max_concurrent: int = None, group: str = None, **specs):
+        """
+        Decorates a view with token buckets per scope ('ip', 'user', 'total'), e.g.
+        limit(ip='20/minute', user='5/minute'). Each bucket can be overridden with
+        RATE_LIMIT_<VIEW>_<SCOPE>, and max_concurrent caps in-flight requests per worker.
+        Views sharing a `group` share its buckets and concurrency slots.
+        """
+        def decorator(view):
+            name = group or view.__name__
+            # The shared total bucket is tried last, so per-client rejections rarely touch it
+            limits = {scope: Limit(os.getenv(f"RATE_LIMIT_{name.upper()}_{scope.upper()}", spec))
+                      for scope, spec in sorted(specs.items(), key=lambda item: item[0] == "total")}
+            slots = self._slots.setdefault(name, threading.BoundedSemaphore(max_concurrent)) \
+                if max_concurrent else None
+
+            def acquire():
+                if self.enabled:
+                    self._check(name, limits)
+                    if slots is not None and not slots.acquire(blocking=False):
+                        raise TooManyRequests("Server is busy. Please try again shortly.", 5, status_code=503)
+
+            def release():
+                if self.enabled and slots is not None:
+                    slots.release()
+
+            if inspect.iscoroutinefunction(view):
+                @functools.wraps(view)
+                async def wrapper(*args, **kwargs):
+                    acquire()
+                    try:
+                        return await view(*args, **kwargs)
+                    finally:
+                        release()
+            else:
+                @functools.wraps(view)
+                def wrapper(*args, **kwargs):
+                    acquire()
+                    try:
+                        response = view(*args, **kwargs)
+                    except BaseException:
+                        release()
+                        raise
+                    if isinstance(response, Response) and response.is_streamed:
+                        # Keep the slot until the client has received the whole stream
+                        response.call_on_close(release)
+                    else:
+                        release()
+                    return response
+            return wrapper
+        return decorator
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+
+from flask import Response, current_app
+
+try:
+    import orjson
+except ImportError:  # plain json through Flask's provider when orjson is not installed
+    orjson = None
+
+# The columns each listing returns, in response order
+LETTER_FIELDS = ("id", "type", "content", "generated_at", "filename")
+ADMIN_LETTER_FIELDS = ("id", "user_id", "user_first_name", "user_last_name", "type", "content", "generated_at")
+USER_FIELDS = ("id", "email", "first_name", "last_name", "phone_number", "gender")
+ADMIN_USER_FIELDS = USER_FIELDS + ("last_login",)
+
+DATETIME_FIELDS = {"generated_at", "updated_at", "created_at", "last_login"}
+
+_DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def format_datetime(value: datetime):
+    """
+    Every datetime in a response uses the RFC 822 format jsonify has always produced
+    (naive values are UTC), built directly rather than through werkzeug's http_date.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return f"{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} " \
+           f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT"
+
+
+def rows_to_dicts(rows, fields: tuple) -> list:
+    """ Column-projected rows to response dicts, formatting the datetime columns """
+    datetimes = [i for i, field in enumerate(fields) if field in DATETIME_FIELDS]
+    if not datetimes:
+        return [dict(zip(fields, row)) for row in rows]
+    result = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        for i in datetimes:
+            item[fields[i]] = format_datetime(row[i])
+        result.append(item)
+    return result
+
+
+def json_response(payload, status: int = 200) -> Response:
+    """ Encodes with orjson when available; payloads hold only JSON types and formatted datetimes """
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = current_app.json.dumps(payload)
+    return Response(body, status=status, mimetype="application/json")
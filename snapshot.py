@@ -0,0 +1,77 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """
+    A read-only copy of a SQLite database, taken with the online backup API. run_forever
+    refreshes it in the background before it turns `max_age` seconds old, so reads never
+    wait for a copy. Heavy reads against the copy never hold locks on the live database,
+    so they cannot delay its writers.
+    """
+
+    def __init__(self, source_path: str, path: str, max_age: float):
+        self.source_path = source_path
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # A fresh connection per session, so every read sees the file the last refresh swapped in
+        engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true", poolclass=NullPool)
+        self._Session = sessionmaker(bind=engine)
+
+    def age(self) -> float:
+        """ Seconds since the snapshot was taken, by any worker """
+        try:
+            return time.time() - os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return float("inf")
+
+    def refresh(self) -> None:
+        """ Copies the live database into a temp file, then swaps it in """
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        source = sqlite3.connect(self.source_path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            # One step, in a single read transaction: a copy made in steps restarts whenever
+            # the database is written between them, and may never finish under steady writes
+            source.backup(target, pages=-1)
+            # Readers open the copy read-only, which a WAL database without its -shm file does not allow
+            target.execute("PRAGMA journal_mode=DELETE")
+        except Exception:
+            target.close()
+            os.remove(tmp_path)
+            raise
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_path, self.path)
+
+    def run_forever(self) -> None:
+        """ Refreshes the copy whenever it is half max_age old; a copy another worker made counts too """
+        while True:
+            try:
+                if self.age() >= self.max_age / 2:
+                    self.refresh()
+            except Exception:
+                logger.exception("Admin snapshot refresh failed")
+            time.sleep(max(self.max_age / 2 - self.age(), 1))
+
+    def session(self):
+        """
+        A session on the snapshot. It is only refreshed here when no background refresh has kept
+        it under max_age, e.g. before the first one finishes or in a script
+        """
+        if self.age() > self.max_age:
+            with self._lock:
+                if self.age() > self.max_age:
+                    self.refresh()
+        return self._Session()
@@ -0,0 +1,69 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "test-password"
+
+# Settings every test process (and every app process a test starts) runs with: no SMTP,
+# no background threads, cheap bcrypt and no rate limits unless a test turns them on
+TEST_ENV = {
+    "SECRET_KEY": "test",
+    "API_KEY": "test",
+    "BCRYPT_ROUNDS": "4",
+    "WARM_UP_ON_START": "0",
+    "RATE_LIMIT_ENABLED": "0",
+    "SESSION_SWEEP_INTERVAL": "0",
+    "EMAIL_OUTBOX_INTERVAL": "0",
+    "MAINTENANCE_INTERVAL": "0",
+    "ADMIN_SNAPSHOT_MAX_AGE": "0",
+}
+
+LETTER_PAYLOAD = {
+    "letter_type": "maternity_leave_letter", "name": "Jane Doe", "staffid": "12345", "phone": "0240000000",
+    "registeredno": "987654", "school": "Example School", "address": "P.O. Box 1", "district_town": "Ho",
+    "address_town": "Ho", "district": "Ho Municipal", "date_on_letter": "2023-07-11",
+}
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """ The app, imported once against a temp database """
+    workdir = tmp_path_factory.mktemp("app")
+    os.environ.update(TEST_ENV)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'test.db'}"
+    os.environ["RENDER_DIR"] = str(workdir / "renders")
+    import app
+    app.AUTH._send_email = lambda *args, **kwargs: None
+    return app
+
+
+@pytest.fixture(scope="session")
+def flask_app(app_module):
+    flask_app = app_module.create_app()
+    flask_app.config["TESTING"] = True
+    return flask_app
+
+
+def add_verified_user(db, email: str, password: str = PASSWORD):
+    """ Inserts a verified teacher directly, bypassing the email round trip """
+    from bcrypt import gensalt, hashpw
+    hashed_password = hashpw(password.encode("utf-8"), gensalt(4)).decode("utf-8")
+    user = db.add_user(email, hashed_password, "Test", "Teacher", "0240000000", "F", "123456")
+    db.update_user(user.id, is_verified=1)
+    return user
+
+
+@pytest.fixture
+def client(app_module, flask_app):
+    """ A test client logged in as a fresh teacher """
+    email = f"{uuid.uuid4().hex}@example.com"
+    add_verified_user(app_module.dbs, email)
+    client = flask_app.test_client()
+    response = client.post("/login", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200, response.data
+    return client
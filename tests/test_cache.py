@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from cache import MemoryCache, RedisCache, SQLiteCache
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCache()
+    if request.param == "sqlite":
+        return SQLiteCache(str(tmp_path / "cache.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCache(client=fakeredis.FakeRedis())
+
+
+def test_get_set_delete(cache):
+    assert cache.get("missing") is None
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    cache.delete("key")
+    assert cache.get("key") is None
+
+
+def test_set_with_ttl_expires(cache):
+    cache.set("key", "value", ttl=0.05)
+    assert cache.get("key") == "value"
+    time.sleep(0.1)
+    assert cache.get("key") is None
+
+
+def test_incr_counts_and_keeps_the_first_ttl(cache):
+    assert cache.incr("counter", ttl=0.2) == 1
+    assert cache.incr("counter", 2, ttl=10) == 3
+    assert cache.get("counter") == "3"
+    time.sleep(0.3)
+    assert cache.get("counter") is None
+    assert cache.incr("counter", ttl=10) == 1
+
+
+def test_redis_incr_sets_the_ttl_in_the_same_transaction():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    RedisCache(client=client).incr("counter", ttl=60)
+    assert 0 < client.pttl("counter") <= 60000
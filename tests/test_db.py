@@ -0,0 +1,159 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect, text
+
+import db
+from user import Base
+
+# The tables of a database created before schema versioning
+BASELINE_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR(250) NOT NULL UNIQUE, "
+    "hashed_password VARCHAR(250) NOT NULL, session_id VARCHAR(250), reset_code VARCHAR(6), "
+    "first_name VARCHAR(250) NOT NULL, last_name VARCHAR(250) NOT NULL, phone_number VARCHAR(20) NOT NULL, "
+    "gender VARCHAR(10) NOT NULL, is_verified INTEGER, verification_code VARCHAR(6), last_login DATETIME, "
+    "is_admin BOOLEAN)",
+    "CREATE TABLE letters (id VARCHAR(36) PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), "
+    "user_first_name VARCHAR(250) NOT NULL, user_last_name VARCHAR(250) NOT NULL, type VARCHAR(50) NOT NULL, "
+    "content TEXT NOT NULL, filename VARCHAR NOT NULL, generated_at DATETIME NOT NULL)",
+    "INSERT INTO users (id, email, hashed_password, first_name, last_name, phone_number, gender, is_verified) "
+    "VALUES (1, 'teacher@example.com', 'x', 'Jane', 'Doe', '0240000000', 'Female', 1)",
+    "INSERT INTO letters VALUES ('a', 1, 'Jane', 'Doe', 'maternity_leave_letter', '{}', 'letter.docx', "
+    "'2024-01-01 00:00:00')",
+]
+
+
+def test_migrate_upgrades_a_baseline_database(tmp_path):
+    engine = db.create_db_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+
+    assert db.migrate(engine) == 1
+    assert db.migrate(engine) == db.SCHEMA_VERSION
+    columns = {column["name"] for column in inspect(engine).get_columns("download_tokens")}
+    assert "letter_id" in columns
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT value FROM stats_counters WHERE name = 'letter_type'")).scalar() == 1
+
+
+def _schema(engine) -> dict:
+    inspector = inspect(engine)
+    return {table: ({column["name"] for column in inspector.get_columns(table)},
+                    {index["name"] for index in inspector.get_indexes(table)})
+            for table in inspector.get_table_names()}
+
+
+def test_migrated_and_fresh_databases_have_the_same_schema(tmp_path):
+    migrated = db.create_db_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with migrated.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+    db.migrate(migrated)
+    fresh = db.create_db_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    db.migrate(fresh)
+
+    assert _schema(fresh) == _schema(migrated)
+    assert "ix_users_last_login" in _schema(fresh)["users"][1]
+
+
+@pytest.fixture(scope="module")
+def postgresql_url():
+    """ TEST_POSTGRESQL_URL, or a throwaway server from testing.postgresql when it and PostgreSQL are installed """
+    url = os.getenv("TEST_POSTGRESQL_URL")
+    if url:
+        yield url
+        return
+    try:
+        import testing.postgresql
+        server = testing.postgresql.Postgresql()
+    except (ImportError, RuntimeError) as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+    try:
+        yield server.url()
+    finally:
+        server.stop()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def database_url(request, tmp_path):
+    if request.param == "sqlite":
+        yield f"sqlite:///{tmp_path / 'test.db'}"
+        return
+    url = request.getfixturevalue("postgresql_url")
+    yield url
+    engine = db.create_db_engine(url)
+    with engine.begin() as conn:
+        Base.metadata.drop_all(conn)
+        conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+    engine.dispose()
+
+
+@pytest.fixture
+def database(database_url, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", database_url)
+    return db.DB()
+
+
+def _add_user(database, email="teacher@example.com"):
+    return database.add_user(email=email, hashed_password="x", first_name="Jane", last_name="Doe",
+                             phone_number="0240000000", gender="Female", verification_code="123456")
+
+
+def test_migrate_creates_a_fresh_database_at_the_current_version(database_url):
+    engine = db.create_db_engine(database_url)
+    assert db.migrate(engine) == db.SCHEMA_VERSION
+    assert db.migrate(engine) == db.SCHEMA_VERSION
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT version FROM schema_version")).scalars().all() == [db.SCHEMA_VERSION]
+    engine.dispose()
+
+
+def test_migrate_upgrades_a_version_8_database(database_url):
+    # The schema as version 8 left it: no outbox claim columns and no last_login index
+    engine = db.create_db_engine(database_url)
+    db.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE email_outbox DROP COLUMN claimed_at"))
+        conn.execute(text("ALTER TABLE email_outbox DROP COLUMN claim_token"))
+        conn.execute(text("DROP INDEX ix_users_last_login"))
+        conn.execute(text("UPDATE schema_version SET version = 8"))
+
+    assert db.migrate(engine) == 8
+    columns = {column["name"] for column in inspect(engine).get_columns("email_outbox")}
+    assert {"claimed_at", "claim_token"} <= columns
+    assert "ix_users_last_login" in {index["name"] for index in inspect(engine).get_indexes("users")}
+    engine.dispose()
+
+
+def test_inserts_return_the_stored_rows(database):
+    user = _add_user(database)
+    assert user.id is not None and user.email == "teacher@example.com"
+
+    letter = database.add_letter(user.id, "maternity_leave_letter", '{"DISTRICT": "Ho Municipal"}', "letter.docx")
+    assert letter.id and letter.user_first_name == "Jane" and letter.generated_at is not None
+    assert database.get_letter(letter.id).filename == "letter.docx"
+
+
+def test_counters_are_upserted(database):
+    user = _add_user(database)
+    for _ in range(3):
+        database.add_letter(user.id, "maternity_leave_letter", '{"DISTRICT": "Ho Municipal"}', "letter.docx")
+    database.add_letter(user.id, "salary_reactivation_letter", "{}", "letter.docx")
+
+    stats = database.get_stat_counters(since=datetime.utcnow().date().isoformat())
+    assert stats["letter_type"] == {"maternity_leave_letter": 3, "salary_reactivation_letter": 1}
+    assert stats["letter_day"] == {datetime.utcnow().date().isoformat(): 4}
+
+
+def test_delete_expired_sessions_in_batches(database):
+    user = _add_user(database)
+    database.update_user(user.id, is_verified=1)
+    for i in range(5):
+        assert database.start_session(user.email, f"expired-{i}", timedelta(seconds=-1)) is not None
+    database.start_session(user.email, "live", timedelta(hours=1))
+
+    assert database.delete_expired_sessions(batch_size=2) == 5
+    assert database.get_user_by_session("live", timedelta(hours=1)) is not None
+    assert database.get_user_by_session("expired-0", timedelta(hours=1)) is None
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+import exam
+
+DATA = {"num_of_mul_choice_ques": 1, "num_of_subjective_ques": 1}
+MUL_CHOICE = {"question": "Which gas do plants take in?", "options": ["Oxygen", "Carbon dioxide"], "answer": "B"}
+SUBJECTIVE = {"question": "Explain photosynthesis.", "answer": "Plants make food from light."}
+
+
+def test_parse_structured_formats_questions_and_marking_scheme():
+    texts = exam.parse_structured(json.dumps({"multiple_choice": [MUL_CHOICE], "subjective": [SUBJECTIVE]}), DATA)
+    assert texts["MARKING_SCHEME_SEC_A"] == "1. B"
+    assert texts["SUBJECTIVE_QUESTIONS"] == "1. Explain photosynthesis."
+
+
+@pytest.mark.parametrize("response", [
+    [MUL_CHOICE, SUBJECTIVE],
+    {"multiple_choice": "A", "subjective": "B"},
+    {"multiple_choice": ["Which gas?"], "subjective": [SUBJECTIVE]},
+    {"multiple_choice": [dict(MUL_CHOICE, question=5)], "subjective": [SUBJECTIVE]},
+    {"multiple_choice": [dict(MUL_CHOICE, options="AB")], "subjective": [SUBJECTIVE]},
+    {"multiple_choice": [dict(MUL_CHOICE, options=[1, 2])], "subjective": [SUBJECTIVE]},
+    {"multiple_choice": [dict(MUL_CHOICE, answer=2)], "subjective": [SUBJECTIVE]},
+    {"multiple_choice": [MUL_CHOICE], "subjective": [None]},
+    {"multiple_choice": [MUL_CHOICE], "subjective": [dict(SUBJECTIVE, answer=["Light"])]},
+])
+def test_parse_structured_rejects_wrong_types(response):
+    with pytest.raises(ValueError):
+        exam.parse_structured(json.dumps(response), DATA)
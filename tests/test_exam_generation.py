@@ -0,0 +1,48 @@
+"""
+Examination generation through the real Gemini client with only its transport stubbed.
+"""
+import json
+
+import pytest
+from google.ai import generativelanguage as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import grpc, grpc_asyncio
+
+EXAM_PAYLOAD = {
+    "school_name": "Test School", "term": "First", "subject": "Science", "class": "Basic 6", "duration": "1 hour",
+    "topics_taught": "Plants, Energy", "num_of_mul_choice_ques": 2, "num_of_subjective_ques": 1,
+    "num_of_sub_ques_to_ans": 1, "generation_mode": "structured"
+}
+
+STRUCTURED_TEXT = json.dumps({
+    "multiple_choice": [{"question": f"Question {i}?", "options": ["One", "Two", "Three", "Four"], "answer": "B"}
+                        for i in range(2)],
+    "subjective": [{"question": "Explain photosynthesis.", "answer": "Plants make food from light."}],
+})
+
+
+def _generate_content(request, **kwargs):
+    content = glm.Content(parts=[glm.Part(text=STRUCTURED_TEXT)], role="model")
+    return glm.GenerateContentResponse(candidates=[glm.Candidate(content=content, finish_reason=1)])
+
+
+def _closed_loop(request, **kwargs):
+    raise RuntimeError("Event loop is closed")
+
+
+@pytest.fixture
+def gemini(app_module, monkeypatch):
+    """ The real GenerativeModel, answering over a stubbed gRPC transport """
+    import llm
+    monkeypatch.setattr(grpc.GenerativeServiceGrpcTransport, "generate_content",
+                        property(lambda self: _generate_content))
+    # The asyncio transport binds to the first event loop it runs on, which asgiref closes after each request
+    monkeypatch.setattr(grpc_asyncio.GenerativeServiceGrpcAsyncIOTransport, "generate_content",
+                        property(lambda self: _closed_loop))
+    monkeypatch.setattr(llm, "_models", {})
+
+
+def test_consecutive_generations_use_a_working_client(gemini, client):
+    for _ in range(2):
+        response = client.post("/generate_examination_questions", json=EXAM_PAYLOAD)
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json()["generation"]["mode"] == "structured"
@@ -0,0 +1,113 @@
+"""
+Shuffled examination papers made from one stored generation.
+"""
+import io
+import json
+import zipfile
+
+import pytest
+
+import exam
+
+QUESTIONS_TEXT = """1. Which part of a plant makes food?
+   A. Root
+   B. Leaf
+   C. Stem
+   D. Flower
+
+2) Which of these is a source of energy?
+A) The sun
+B) A stone
+C) Sand
+D) None of the above
+
+**3. Plants take in which gas**
+   for photosynthesis?
+   (a) Oxygen
+   (b) Carbon dioxide
+   (c) Nitrogen
+   (d) All of the above
+"""
+
+ANSWERS_TEXT = """1. B
+2) A
+3. Answer: (b)
+"""
+
+
+@pytest.fixture
+def questions():
+    return exam.parse_multiple_choice(QUESTIONS_TEXT, ANSWERS_TEXT)
+
+
+def _correct_options(questions: list) -> dict:
+    return {item["question"]: item["options"][item["answer"]] for item in questions}
+
+
+def test_parse_reads_questions_options_and_answers(questions):
+    assert [item["question"] for item in questions] == [
+        "Which part of a plant makes food?", "Which of these is a source of energy?",
+        "Plants take in which gas for photosynthesis?"]
+    assert questions[0]["options"] == ["Root", "Leaf", "Stem", "Flower"]
+    assert questions[2]["options"][3] == "All of the above"
+    assert _correct_options(questions) == {
+        "Which part of a plant makes food?": "Leaf",
+        "Which of these is a source of energy?": "The sun",
+        "Plants take in which gas for photosynthesis?": "Carbon dioxide"}
+
+
+def test_parse_rejects_a_question_without_an_answer():
+    with pytest.raises(ValueError):
+        exam.parse_multiple_choice(QUESTIONS_TEXT, "1. B\n2. A")
+
+
+def test_shuffle_is_decided_by_the_seed(questions):
+    assert exam.shuffle_multiple_choice(questions, "seed:A") == exam.shuffle_multiple_choice(questions, "seed:A")
+    papers = [exam.shuffle_multiple_choice(questions, f"seed:{label}") for label in "ABCDEF"]
+    assert len({json.dumps(paper) for paper in papers}) > 1
+
+
+def test_answers_follow_their_options(questions):
+    for label in "ABCDEF":
+        paper = exam.shuffle_multiple_choice(questions, f"seed:{label}")
+        assert _correct_options(paper) == _correct_options(questions)
+        assert all(sorted(item["options"]) == sorted(original["options"])
+                   for item in paper for original in questions if original["question"] == item["question"])
+
+
+def test_positional_options_keep_their_place(questions):
+    for label in "ABCDEF":
+        paper = {item["question"]: item for item in exam.shuffle_multiple_choice(questions, f"seed:{label}")}
+        assert paper["Which of these is a source of energy?"]["options"][3] == "None of the above"
+        assert paper["Plants take in which gas for photosynthesis?"]["options"][3] == "All of the above"
+
+
+def _paper_text(document: bytes) -> str:
+    """ The paragraphs of a rendered paper, one per line """
+    from docx import Document
+    return "\n".join(paragraph.text for paragraph in Document(io.BytesIO(document)).paragraphs)
+
+
+def test_endpoint_returns_papers_with_matching_answer_keys(app_module, client, questions):
+    user = app_module.AUTH.get_user_from_session_id(client.get_cookie("session_id").value)
+    mul_choice, marking_scheme = exam.format_multiple_choice(questions)
+    context = {"SCHOOL_NAME": "TEST SCHOOL", "TERM": "FIRST", "SUBJECT": "SCIENCE", "CLASS": "BASIC 6",
+               "DURATION": "1 HOUR", "MUL_CHOICE_QUES": mul_choice, "NUM_OF_QUES_TO_ANS": 1,
+               "SUBJECTIVE_QUESTIONS": "1. Explain photosynthesis.", "MARKING_SCHEME_SEC_A": marking_scheme,
+               "MARKING_SCHEME_SEC_B": "1. Plants make food from light."}
+    letter = app_module.dbs.add_letter(user.id, "examination_questions", json.dumps(context), "Science.docx")
+
+    response = client.post(f"/examination_variants/{letter.id}", json={"variants": 3, "seed": "term-1"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == [f"Paper {label} - Science.docx" for label in "ABC"]
+        papers = {label: _paper_text(archive.read(f"Paper {label} - Science.docx")) for label in "ABC"}
+
+    for label, text in papers.items():
+        assert f"SCIENCE (PAPER {label})" in text
+        # Read the paper's questions and Section A key back: every question keeps its correct option
+        paper_questions = text.split("SECTION A", 1)[1].split("SECTION B", 1)[0]
+        paper_key = text.split("MARKING SCHEME FOR SECTION A", 1)[1].split("MARKING SCHEME FOR SECTION B", 1)[0]
+        assert _correct_options(exam.parse_multiple_choice(paper_questions, paper_key)) == _correct_options(questions)
+    assert len(set(papers.values())) == 3
@@ -0,0 +1,66 @@
+"""
+ETags, conditional GETs and ranged downloads for the routes mobile clients poll.
+"""
+from conftest import LETTER_PAYLOAD
+
+PROFILE = {"first_name": "Jane", "last_name": "Doe", "phone_number": "0240000001", "gender": "F"}
+
+
+def _revalidate(client, url: str):
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    return first, client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+
+
+def test_profile_is_not_modified_until_it_changes(client):
+    first, cached = _revalidate(client, "/profile")
+    assert cached.status_code == 304
+    assert cached.data == b""
+    assert cached.headers["ETag"] == first.headers["ETag"]
+
+    assert client.put("/profile", json=PROFILE).status_code == 200
+    changed = client.get("/profile", headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200
+    assert changed.get_json()["phone_number"] == "0240000001"
+
+
+def test_letter_list_changes_when_a_letter_is_added(client):
+    assert client.post("/generate_letter", json=LETTER_PAYLOAD).status_code == 200
+    first, cached = _revalidate(client, "/user_letters")
+    assert cached.status_code == 304
+
+    assert client.post("/generate_letter", json=LETTER_PAYLOAD).status_code == 200
+    changed = client.get("/user_letters", headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200
+    assert len(changed.get_json()["letters"]) == 2
+
+
+def test_single_letter_is_not_modified(client):
+    assert client.post("/generate_letter", json=LETTER_PAYLOAD).status_code == 200
+    letter_id = client.get("/user_letters").get_json()["letters"][0]["id"]
+    _, cached = _revalidate(client, f"/user_letters/{letter_id}")
+    assert cached.status_code == 304
+
+
+def test_download_supports_conditional_and_range_requests(client):
+    url = client.post("/generate_letter", json=LETTER_PAYLOAD).get_json()["download_url"]
+    first, cached = _revalidate(client, url)
+    document, etag = first.data, first.headers["ETag"]
+    assert document[:2] == b"PK"
+    assert first.headers["Accept-Ranges"] == "bytes"
+    assert cached.status_code == 304
+
+    ranged = client.get(url, headers={"Range": "bytes=0-99"})
+    assert ranged.status_code == 206
+    assert ranged.headers["Content-Range"] == f"bytes 0-99/{len(document)}"
+    assert ranged.data == document[:100]
+
+    resumed = client.get(url, headers={"Range": "bytes=100-", "If-Range": etag})
+    assert resumed.status_code == 206
+    assert resumed.data == document[100:]
+    # A stale If-Range gets the whole document again
+    stale = client.get(url, headers={"Range": "bytes=100-", "If-Range": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == document
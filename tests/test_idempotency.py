@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from conftest import LETTER_PAYLOAD
+from idempotency import Idempotency
+
+
+def test_replayed_download_link_still_works(client):
+    headers = {"Idempotency-Key": "letter-1"}
+    first = client.post("/generate_letter", json=LETTER_PAYLOAD, headers=headers)
+    replay = client.post("/generate_letter", json=LETTER_PAYLOAD, headers=headers)
+    assert first.status_code == replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.get_json()["download_url"] == first.get_json()["download_url"]
+    assert client.get(replay.get_json()["download_url"]).status_code == 200
+
+
+def test_keys_do_not_outlive_download_links(app_module, monkeypatch):
+    monkeypatch.setenv("IDEMPOTENCY_TTL_HOURS", "24")
+    assert Idempotency(app_module.dbs).ttl == app_module.dbs.download_token_ttl == timedelta(minutes=30)
+    monkeypatch.setenv("IDEMPOTENCY_TTL_HOURS", "0.1")
+    assert Idempotency(app_module.dbs).ttl == timedelta(minutes=6)
+
+
+def test_parallel_duplicates_run_once_and_replay(app_module, client, monkeypatch):
+    calls, issue_download = [], app_module._issue_download
+
+    def slow_issue_download(*args, **kwargs):
+        calls.append(threading.get_ident())
+        time.sleep(0.2)  # Keeps the first request in flight while its duplicates arrive
+        return issue_download(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, "_issue_download", slow_issue_download)
+    headers = {"Idempotency-Key": "parallel"}
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        responses = list(pool.map(lambda _: client.post("/generate_letter", json=LETTER_PAYLOAD, headers=headers),
+                                  range(5)))
+
+    assert len(calls) == 1
+    assert [response.status_code for response in responses] == [200] * 5
+    assert sum(response.headers.get("Idempotent-Replayed") == "true" for response in responses) == 4
+    assert len({response.get_json()["download_url"] for response in responses}) == 1
+    assert len(client.get("/user_letters").get_json()["letters"]) == 1
+
+
+def test_reused_key_with_a_different_body_is_rejected(client):
+    headers = {"Idempotency-Key": "reused"}
+    assert client.post("/generate_letter", json=LETTER_PAYLOAD, headers=headers).status_code == 200
+    response = client.post("/generate_letter", json=dict(LETTER_PAYLOAD, name="John Doe"), headers=headers)
+    assert response.status_code == 422
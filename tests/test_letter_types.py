@@ -0,0 +1,24 @@
+import pytest
+
+from conftest import LETTER_PAYLOAD
+from letter_types import TRANSFORMS
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2023-07-11", "July 11, 2023"),
+    ("2023-7-1", "July 01, 2023"),
+])
+def test_dates_are_formatted(value, expected):
+    assert TRANSFORMS["date"](value) == expected
+
+
+@pytest.mark.parametrize("value", ["11/07/2023", "2023-13-01", "", None, 20230711])
+def test_invalid_dates_are_rejected(value):
+    with pytest.raises(ValueError):
+        TRANSFORMS["date"](value)
+
+
+@pytest.mark.parametrize("date_on_letter, status", [("2023-7-1", 200), ("July 1st", 400)])
+def test_generate_letter_date_handling(client, date_on_letter, status):
+    response = client.post("/generate_letter", json=dict(LETTER_PAYLOAD, date_on_letter=date_on_letter))
+    assert response.status_code == status, response.get_json()
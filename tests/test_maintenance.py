@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import maintenance
+from maintenance import Maintenance
+
+
+def test_archiving_is_opt_in(app_module, monkeypatch):
+    monkeypatch.delenv("ARCHIVE_LETTERS_AFTER_DAYS", raising=False)
+    assert Maintenance(app_module.dbs, "renders").archive_after_days == 0
+
+
+def test_one_run_per_interval_across_workers(app_module, tmp_path, monkeypatch):
+    runs = []
+    monkeypatch.setattr(Maintenance, "run", lambda self, **kwargs: runs.append(self))
+    clock = [100000.0]
+    monkeypatch.setattr(maintenance, "time", SimpleNamespace(time=lambda: clock[0]))
+    lock_path = str(tmp_path / "maint.lock")
+    workers = [Maintenance(app_module.dbs, str(tmp_path)) for _ in range(3)]
+
+    assert [worker.run_if_due(lock_path, 3600) for worker in workers] == [True, False, False]
+    clock[0] += 3599
+    assert not any(worker.run_if_due(lock_path, 3600) for worker in workers)
+    clock[0] += 1
+    assert [worker.run_if_due(lock_path, 3600) for worker in reversed(workers)] == [True, False, False]
+    assert runs == [workers[0], workers[2]]
+
+
+def test_a_worker_holding_the_lock_blocks_others(app_module, tmp_path):
+    lock_path = str(tmp_path / "maint.lock")
+    with maintenance._try_lock(lock_path) as held:
+        assert held is not None
+        assert not Maintenance(app_module.dbs, str(tmp_path)).run_if_due(lock_path, 0)
@@ -0,0 +1,50 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+from db import DB
+from user import OutboxEmail
+
+
+@pytest.fixture
+def outbox_db(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'outbox.db'}")
+    return DB()
+
+
+def _queue(db, count: int) -> None:
+    session = db._create_session()
+    session.add_all([OutboxEmail(to_email=f"teacher{i}@example.com", subject="Verify", body="Code")
+                     for i in range(count)])
+    session.commit()
+    session.close()
+
+
+def test_concurrent_workers_claim_each_email_once(outbox_db):
+    _queue(outbox_db, 40)
+    claimed, barrier = [], threading.Barrier(4)
+
+    def worker():
+        barrier.wait()
+        claimed.extend(email.id for email in outbox_db.claim_pending_emails(limit=15))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(set(claimed))
+    assert len(claimed) == 40
+
+
+def test_failed_and_stale_claims_are_retried(outbox_db):
+    _queue(outbox_db, 2)
+    first, second = outbox_db.claim_pending_emails()
+    assert outbox_db.claim_pending_emails() == []
+
+    outbox_db.mark_email_failed(first.id, "SMTP unavailable")
+    outbox_db.mark_email_sent(second.id)
+    assert [email.id for email in outbox_db.claim_pending_emails()] == [first.id]
+    # The worker holding the claim died; after stale_after another one takes it over
+    assert [email.id for email in outbox_db.claim_pending_emails(stale_after=timedelta(0))] == [first.id]
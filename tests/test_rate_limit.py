@@ -0,0 +1,178 @@
+"""
+Token buckets, the 429 they raise and the per-worker concurrency cap.
+"""
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+
+import rate_limit
+from custom_error import CustomError
+from cache import MemoryCache
+from conftest import PASSWORD, add_verified_user
+from rate_limit import CacheBackend, Limit, MemoryBackend, RateLimiter, SQLiteBackend
+
+
+class FakeClock:
+    """ Stands in for the time module so refill can be tested without sleeping """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", fake)
+    return fake
+
+
+@pytest.fixture(params=["memory", "sqlite", "cache"])
+def any_backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "rate_limits.db"))
+    return CacheBackend(MemoryCache())
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / "rate_limits.db"))
+
+
+def test_bucket_refills_over_time(backend, clock):
+    limit = Limit("2/minute")
+    assert backend.take("key", limit) == 0
+    assert backend.take("key", limit) == 0
+    assert backend.take("key", limit) == pytest.approx(30)
+
+    clock.now += 30
+    assert backend.take("key", limit) == 0
+    assert backend.take("key", limit) == pytest.approx(30)
+
+
+def test_buckets_are_per_key(backend, clock):
+    limit = Limit("1/hour")
+    assert backend.take("first", limit) == 0
+    assert backend.take("second", limit) == 0
+    assert backend.take("first", limit) > 0
+
+
+@pytest.fixture
+def limited_app(app_module, monkeypatch):
+    """ A small app sharing the API's error handler, with limiting switched on """
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "1")
+    limiter = RateLimiter(backend=MemoryBackend())
+    app = Flask(__name__)
+    app.register_error_handler(CustomError, app_module.handle_custom_error)
+    release = threading.Event()
+    entered = threading.Semaphore(0)
+
+    @app.route("/limited")
+    @limiter.limit(ip="2/minute")
+    def limited():
+        return "ok"
+
+    @app.route("/slow")
+    @limiter.limit(max_concurrent=2)
+    def slow():
+        entered.release()
+        release.wait(10)
+        return "ok"
+
+    app.release, app.entered = release, entered
+    return app
+
+
+def test_exceeding_a_limit_returns_429_with_retry_after(limited_app, clock):
+    client = limited_app.test_client()
+    assert [client.get("/limited").status_code for _ in range(2)] == [200, 200]
+
+    response = client.get("/limited")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+
+    clock.now += 30
+    assert client.get("/limited").status_code == 200
+
+
+def test_concurrency_cap_returns_503_under_parallel_requests(limited_app):
+    client = limited_app.test_client()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        held = [pool.submit(client.get, "/slow") for _ in range(2)]
+        for _ in held:
+            assert limited_app.entered.acquire(timeout=10)
+        rejected = list(pool.map(lambda _: client.get("/slow"), range(2)))
+        limited_app.release.set()
+        assert [future.result().status_code for future in held] == [200, 200]
+
+    assert [response.status_code for response in rejected] == [503, 503]
+    assert all(response.headers["Retry-After"] == "5" for response in rejected)
+    # Slots are returned once the requests finish
+    assert client.get("/slow").status_code == 200
+
+
+def test_one_abusive_ip_does_not_drain_the_total_for_others(app_module, any_backend, clock, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "1")
+    limiter = RateLimiter(backend=any_backend)
+    app = Flask(__name__)
+    app.register_error_handler(CustomError, app_module.handle_custom_error)
+
+    @app.route("/register")
+    @limiter.limit(total="6/minute", ip="2/minute")
+    def register():
+        return "ok"
+
+    client = app.test_client()
+    abusive = [client.get("/register", environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code for _ in range(20)]
+    assert abusive == [200, 200] + [429] * 18
+    others = [client.get("/register", environ_base={"REMOTE_ADDR": f"10.0.0.{i}"}).status_code for i in (2, 3)]
+    assert others == [200, 200]
+
+
+def test_user_bucket_follows_the_user_across_logins(app_module, flask_app, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "1")
+    limiter = RateLimiter(backend=MemoryBackend(), user_id=app_module.limiter._user_id)
+    app = Flask(__name__)
+    app.register_error_handler(CustomError, app_module.handle_custom_error)
+
+    @app.route("/generate")
+    @limiter.limit(user="2/hour")
+    def generate():
+        return "ok"
+
+    email = f"{uuid.uuid4().hex}@example.com"
+    add_verified_user(app_module.dbs, email)
+    statuses = []
+    for _ in range(3):
+        # Every login opens a new session with a new cookie
+        session_id = app_module.AUTH.login(email, PASSWORD)
+        client = app.test_client()
+        client.set_cookie("session_id", session_id)
+        statuses.append(client.get("/generate").status_code)
+    assert statuses == [200, 200, 429]
+
+
+def test_client_ip_comes_from_trusted_proxy_headers(app_module, monkeypatch):
+    monkeypatch.setenv("TRUSTED_PROXIES", "1")
+    app = app_module.create_app()
+
+    @app.route("/whoami")
+    def whoami():
+        return rate_limit._client_ip()
+
+    client = app.test_client()
+    response = client.get("/whoami", headers={"X-Forwarded-For": "203.0.113.7"},
+                          environ_base={"REMOTE_ADDR": "127.0.0.1"})
+    assert response.text == "203.0.113.7"
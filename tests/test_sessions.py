@@ -0,0 +1,85 @@
+"""
+A user can hold several sessions at once, each ending on its own, all ending on a password reset.
+"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from conftest import PASSWORD, add_verified_user
+from user import UserSession
+
+
+@pytest.fixture
+def email(app_module):
+    email = f"{uuid.uuid4().hex}@example.com"
+    add_verified_user(app_module.dbs, email)
+    return email
+
+
+def _login(flask_app, email: str, password: str = PASSWORD):
+    client = flask_app.test_client()
+    response = client.post("/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.data
+    return client
+
+
+def test_concurrent_logins_each_get_a_session(flask_app, email):
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        clients = list(pool.map(lambda _: _login(flask_app, email), range(2)))
+    cookies = {client.get_cookie("session_id").value for client in clients}
+    assert len(cookies) == 2
+    assert all(client.get("/profile").status_code == 200 for client in clients)
+
+
+def test_logout_ends_only_its_own_session(flask_app, email):
+    phone, laptop = _login(flask_app, email), _login(flask_app, email)
+    assert phone.delete("/logout").status_code == 302
+    assert phone.get("/profile").status_code == 403
+    assert laptop.get("/profile").status_code == 200
+
+
+def test_password_reset_ends_every_session(app_module, flask_app, email):
+    clients = [_login(flask_app, email) for _ in range(2)]
+    assert flask_app.test_client().post("/forgot_password", json={"email": email}).status_code == 200
+    reset_code = app_module.dbs.find_user_by(email=email).reset_code
+    response = flask_app.test_client().post(
+        "/reset_password", json={"email": email, "reset_code": reset_code, "new_password": "new-password"})
+    assert response.status_code == 200
+    assert [client.get("/profile").status_code for client in clients] == [403, 403]
+    assert _login(flask_app, email, "new-password").get("/profile").status_code == 200
+
+
+def test_expiry_slides_while_the_session_is_used(app_module, email):
+    dbs, duration = app_module.dbs, timedelta(hours=3)
+    session_id = uuid.uuid4().hex
+    dbs.start_session(email, session_id, duration)
+
+    def set_expiry(expires_at):
+        session = dbs._create_session()
+        session.execute(update(UserSession).where(UserSession.id == session_id).values(expires_at=expires_at))
+        session.commit()
+        session.close()
+
+    def expiry():
+        session = dbs._create_session()
+        try:
+            return session.scalar(select(UserSession.expires_at).where(UserSession.id == session_id))
+        finally:
+            session.close()
+
+    # More than half the duration left: validated without a write
+    untouched = datetime.utcnow() + timedelta(hours=2)
+    set_expiry(untouched)
+    assert dbs.get_user_by_session(session_id, duration) is not None
+    assert expiry() == untouched
+
+    # Less than half left: pushed a full duration ahead
+    set_expiry(datetime.utcnow() + timedelta(minutes=10))
+    assert dbs.get_user_by_session(session_id, duration) is not None
+    assert expiry() > datetime.utcnow() + timedelta(hours=2, minutes=59)
+
+    set_expiry(datetime.utcnow() - timedelta(seconds=1))
+    assert dbs.get_user_by_session(session_id, duration) is None
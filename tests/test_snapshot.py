@@ -0,0 +1,38 @@
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import text
+
+from snapshot import Snapshot
+
+
+def test_refresh_finishes_under_steady_writes(tmp_path):
+    source_path = str(tmp_path / "live.db")
+    conn = sqlite3.connect(source_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, body TEXT)")
+    conn.executemany("INSERT INTO items (body) VALUES (?)", [("x" * 1000,)] * 5000)
+    stop = threading.Event()
+
+    def write():
+        writer = sqlite3.connect(source_path, isolation_level=None)
+        while not stop.is_set():
+            writer.execute("INSERT INTO items (body) VALUES ('y')")
+        writer.close()
+
+    snapshot = Snapshot(source_path, str(tmp_path / "live.db.snapshot"), max_age=60)
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        time.sleep(0.05)
+        snapshot.refresh()
+    finally:
+        stop.set()
+        thread.join()
+    session = snapshot.session()
+    try:
+        assert session.execute(text("SELECT COUNT(*) FROM items")).scalar() >= 5000
+    finally:
+        session.close()
+    assert snapshot.age() < 60
@@ -0,0 +1,42 @@
+"""
+Cold start: importing the WSGI entry point must stay cheap, leaving the Gemini client,
+the DOCX renderer and bcrypt to be loaded on first use or by the background warm-up.
+"""
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ROOT, TEST_ENV
+
+# Seconds a cold `import wsgi` may take; raise it with STARTUP_BUDGET_SECONDS on slow machines
+BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "2.0"))
+
+HEAVY_MODULES = ("google.generativeai", "docxtpl", "bcrypt")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import wsgi
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def _cold_import(tmp_path) -> dict:
+    env = dict(os.environ, **TEST_ENV, DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}",
+               RENDER_DIR=str(tmp_path / "renders"))
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True, timeout=60).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_defers_heavy_modules(tmp_path):
+    assert _cold_import(tmp_path)["loaded"] == []
+
+
+def test_import_stays_within_budget(tmp_path):
+    # The first import creates the schema; the budget applies to a worker starting on a migrated database
+    _cold_import(tmp_path)
+    timings = sorted(_cold_import(tmp_path)["seconds"] for _ in range(3))
+    assert timings[1] <= BUDGET_SECONDS, f"median cold import took {timings[1]:.2f}s (budget {BUDGET_SECONDS}s)"
@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+from cache import SQLiteCache
+from db import DB
+from tokens import TokenSigner
+
+
+@pytest.fixture
+def token_db(tmp_path, monkeypatch):
+    """ A database of its own, so revocations do not leak into other tests """
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'tokens.db'}")
+    return DB()
+
+
+@pytest.fixture
+def signer(token_db):
+    return TokenSigner("test", token_db)
+
+
+def _issue(signer, user_id: int) -> str:
+    return signer.issue(user_id, f"teacher{user_id}@example.com", False, timedelta(hours=1))
+
+
+def test_issued_token_verifies(signer):
+    claims = signer.verify(signer.issue(1, "teacher@example.com", False, timedelta(hours=1)))
+    assert claims["email"] == "teacher@example.com"
+
+
+@pytest.mark.parametrize("token", ["", "body", "body.signature", "bödy.signature", "body.sïgnature", "☃"])
+def test_malformed_tokens_are_rejected(signer, token):
+    assert signer.verify(token) is None
+
+
+def test_tampered_token_is_rejected(signer):
+    token = signer.issue(1, "teacher@example.com", False, timedelta(hours=1))
+    assert signer.verify(token[:-1] + ("A" if token[-1] != "A" else "B")) is None
+
+
+def test_revoked_token_is_rejected(signer):
+    token, other = _issue(signer, 1), _issue(signer, 1)
+    signer.revoke(token)
+    assert signer.verify(token) is None
+    assert signer.verify(other) is not None
+
+
+def test_revoke_user_rejects_every_earlier_token_of_that_user(signer):
+    tokens, bystander = [_issue(signer, 1) for _ in range(2)], _issue(signer, 2)
+    signer.revoke_user(1, timedelta(hours=1))
+    assert [signer.verify(token) for token in tokens] == [None, None]
+    assert signer.verify(bystander) is not None
+    time.sleep(0.002)  # iat has millisecond resolution
+    assert signer.verify(_issue(signer, 1)) is not None
+
+
+def test_revocations_reach_other_workers(token_db, tmp_path):
+    # Another worker shares the database and, through the cache version key, learns of revocations at once
+    shared = SQLiteCache(str(tmp_path / "cache.db"))
+    worker, other_worker = (TokenSigner("test", token_db, refresh_seconds=3600, cache=shared) for _ in range(2))
+    token, bystander = _issue(worker, 1), _issue(worker, 2)
+    assert other_worker.verify(token) is not None
+
+    worker.revoke_user(1, timedelta(hours=1))
+    assert other_worker.verify(token) is None
+    assert other_worker.verify(bystander) is not None
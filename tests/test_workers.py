@@ -0,0 +1,69 @@
+"""
+Two app processes sharing one SQLite database, as Gunicorn workers do: a download link
+issued by one must be served by the other.
+"""
+import json
+import os
+import subprocess
+import sys
+import urllib.request
+
+import pytest
+
+from conftest import LETTER_PAYLOAD, PASSWORD, ROOT, TEST_ENV, add_verified_user
+
+SERVER = """
+import sys
+sys.path.insert(0, {root!r})
+from werkzeug.serving import make_server
+import app
+app.AUTH._send_email = lambda *args, **kwargs: None
+server = make_server("127.0.0.1", 0, app.create_app(), threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """ Starts two app processes on one database, each with its own render directory; yields their base URLs """
+    database_url = f"sqlite:///{tmp_path / 'shared.db'}"
+    processes, urls = [], []
+    try:
+        for name in ("a", "b"):
+            env = dict(os.environ, **TEST_ENV, DATABASE_URL=database_url, RENDER_DIR=str(tmp_path / f"renders_{name}"))
+            process = subprocess.Popen([sys.executable, "-c", SERVER.format(root=ROOT)], cwd=ROOT, env=env,
+                                       stdout=subprocess.PIPE, text=True)
+            processes.append(process)
+            urls.append(f"http://127.0.0.1:{int(process.stdout.readline())}")
+        monkeypatch.setenv("DATABASE_URL", database_url)
+        from db import DB
+        add_verified_user(DB(), "worker@example.com")
+        yield urls
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(10)
+
+
+def _request(url: str, payload: dict = None, cookie: str = None):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode() if payload is not None else None,
+                                     headers={"Content-Type": "application/json"})
+    if cookie:
+        request.add_header("Cookie", cookie)
+    return urllib.request.urlopen(request, timeout=30)
+
+
+def test_download_issued_by_one_worker_is_served_by_another(workers, tmp_path):
+    worker_a, worker_b = workers
+    login = _request(f"{worker_a}/login", {"email": "worker@example.com", "password": PASSWORD})
+    cookie = login.headers["Set-Cookie"].split(";")[0]
+
+    generated = json.load(_request(f"{worker_a}/generate_letter", LETTER_PAYLOAD, cookie))
+    download_url = generated["download_url"].replace(worker_a, worker_b)
+    assert download_url.startswith(worker_b)
+
+    download = _request(download_url)
+    assert download.status == 200
+    assert download.read()[:2] == b"PK"  # a .docx is a ZIP archive
+    assert os.listdir(tmp_path / "renders_b")
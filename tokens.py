@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import hmac
+import json
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+# Bumped in the shared cache on every revocation
+REVOCATIONS_VERSION_KEY = "auth:revocations:version"
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _epoch(utc: datetime) -> float:
+    """ Seconds since the epoch for a naive UTC datetime, as stored in the database """
+    return utc.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TokenUser:
+    """
+    The user a signed token was issued to. id, email and is_admin come from the token
+    itself; any other attribute loads the full user from the database on first access.
+    """
+
+    def __init__(self, claims: dict, loader):
+        self.id = claims["uid"]
+        self.email = claims["email"]
+        self.is_admin = claims["adm"]
+        self._loader = loader
+        self._user = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = self._loader(self.id)
+        return getattr(self._user, name)
+
+
+class TokenSigner:
+    """
+    Issues and verifies HMAC-SHA256 signed, expiring session tokens. Revocations are
+    persisted through `db` so every worker sees them, but checked against an in-process
+    copy that is refreshed at most every `refresh_seconds`, keeping validation free of DB access.
+    With a shared `cache`, each revocation also bumps a version key there, and every worker
+    reloads as soon as it sees the version change.
+    """
+
+    def __init__(self, secret: str, db, refresh_seconds: float = 5.0, cache=None):
+        if not secret:
+            raise ValueError("SECRET_KEY must be set to use signed session tokens")
+        self._key = secret.encode("utf-8")
+        self._db = db
+        self._refresh_seconds = refresh_seconds
+        self._cache = cache if cache is not None and cache.shared else None
+        self._version = None
+        self._lock = threading.Lock()
+        self._revoked_tokens = set()
+        self._revoked_users = {}
+        self._loaded_at = 0.0
+
+    def _sign(self, body: str) -> str:
+        return _b64encode(hmac.new(self._key, body.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, user_id: int, email: str, is_admin: bool, duration: timedelta) -> str:
+        now = time.time()
+        # iat is rounded down, so a token issued just before revoke_user never looks newer than the revocation
+        claims = {"uid": user_id, "email": email, "adm": bool(is_admin), "iat": math.floor(now * 1000) / 1000,
+                  "exp": int(now + duration.total_seconds()), "jti": uuid4().hex}
+        body = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{body}.{self._sign(body)}"
+
+    def verify(self, token: str):
+        """ Returns the token's claims if the signature is valid and it has not expired or been revoked """
+        # Cookies are client input; a valid token is always base64url, so anything else is forged
+        if not token.isascii():
+            return None
+        body, _, signature = token.partition(".")
+        if not signature or not hmac.compare_digest(signature, self._sign(body)):
+            return None
+        try:
+            claims = json.loads(_b64decode(body))
+        except ValueError:
+            return None
+        if claims["exp"] <= time.time() or self._is_revoked(claims):
+            return None
+        return claims
+
+    def revoke(self, token: str) -> None:
+        """ Revokes a single token, e.g. on logout """
+        claims = self.verify(token)
+        if claims is None:
+            return
+        self._db.add_revocation(claims["jti"], None, datetime.utcfromtimestamp(claims["exp"]))
+        with self._lock:
+            self._revoked_tokens.add(claims["jti"])
+        self._announce()
+
+    def revoke_user(self, user_id: int, duration: timedelta) -> None:
+        """ Revokes every token issued to a user so far, e.g. on password reset """
+        now = datetime.utcnow()
+        self._db.add_revocation(f"user:{user_id}", user_id, now + duration, revoked_at=now)
+        with self._lock:
+            self._revoked_users[user_id] = _epoch(now)
+        self._announce()
+
+    def _announce(self) -> None:
+        if self._cache is not None:
+            self._cache.incr(REVOCATIONS_VERSION_KEY)
+
+    def _is_revoked(self, claims: dict) -> bool:
+        version = self._cache.get(REVOCATIONS_VERSION_KEY) if self._cache is not None else None
+        if version != self._version or time.monotonic() - self._loaded_at > self._refresh_seconds:
+            # Read the version first, so a revocation made during the reload triggers another
+            self._reload()
+            self._version = version
+        revoked_at = self._revoked_users.get(claims["uid"])
+        return claims["jti"] in self._revoked_tokens or (revoked_at is not None and claims["iat"] < revoked_at)
+
+    def _reload(self) -> None:
+        revoked_tokens, revoked_users = set(), {}
+        for key, user_id, revoked_at in self._db.get_revocations():
+            if user_id is None:
+                revoked_tokens.add(key)
+            else:
+                revoked_users[user_id] = max(revoked_users.get(user_id, 0), _epoch(revoked_at))
+        with self._lock:
+            self._revoked_tokens = revoked_tokens
+            self._revoked_users = revoked_users
+            self._loaded_at = time.monotonic()
@@ -20,18 +20,81 @@ class User(Base):
     gender = Column(String(10), nullable=False)
     is_verified = Column(Integer, default=0)
     verification_code = Column(String(6))
-    last_login = Column(DateTime)
+    last_login = Column(DateTime, index=True)
     is_admin = Column(Boolean, default=False)  # Assuming this field is to distinguish admin users
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 class Letter(Base):
     __tablename__ = 'letters'
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     user_first_name = Column(String(250), nullable=False)
     user_last_name = Column(String(250), nullable=False)
     user = relationship('User', backref=backref('letters', lazy=True))
     type = Column(String(50), nullable=False)
     content = Column(Text, nullable=False)
     filename = Column(String, nullable=False)
-    generated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
\ No newline at end of file
+    generated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DownloadToken(Base):
+    __tablename__ = 'download_tokens'
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    template_name = Column(String(50), nullable=False)
+    context = Column(Text, nullable=False)
+    letter_id = Column(String(36))
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class UserSession(Base):
+    __tablename__ = 'sessions'
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class RevokedToken(Base):
+    __tablename__ = 'revoked_tokens'
+    # A token id, or 'user:<id>' to revoke every token the user was issued before revoked_at
+    id = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    revoked_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class OutboxEmail(Base):
+    __tablename__ = 'email_outbox'
+    id = Column(Integer, primary_key=True)
+    to_email = Column(String(250), nullable=False)
+    subject = Column(String(250), nullable=False)
+    body = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    # Set by the worker sending the email, so other workers skip it
+    claimed_at = Column(DateTime)
+    claim_token = Column(String(32))
+
+
+class StatCounter(Base):
+    """ A running count for the admin dashboard, e.g. ('letter_type', 'maternity_leave_letter') """
+    __tablename__ = 'stats_counters'
+    name = Column(String(32), primary_key=True)
+    key = Column(String(250), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """ The stored outcome of a request sent with an Idempotency-Key header; status_code is NULL while in flight """
+    __tablename__ = 'idempotency_keys'
+    id = Column(String(64), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    mimetype = Column(String(100))
+    body = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)